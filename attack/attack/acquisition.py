@@ -0,0 +1,162 @@
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+# Capture backends provide
+#   n_samples: number of samples per trace
+#   dtype: dtype of the returned traces
+#   capture_batch(boolean_shares): traces of the b2a conversion of each row of
+#       'boolean_shares' with shape (len(boolean_shares), n_samples)
+# See ChipWhispererBackend in capture.py for the hardware backend.
+
+# Software stand-in for the target device. Synthesizes traces of the b2a conversion with
+# Hamming weight leakage of every share at 'share_points' and a leakage of the label
+# (unmasked y >= y_intermediate) with strength 'label_leakage' at 'label_points', plus
+# Gaussian noise with standard deviation 'noise'. With dtype int16 the traces are
+# quantized like ADC samples with 'adc_scale' counts per unit.
+class SimulatedBackend:
+    def __init__(self, y_intermediate=2**17, n_samples=400, share_points=(120, 200), label_points=(160, 161, 162),
+                 label_leakage=0.5, noise=1.0, dtype=np.float32, adc_scale=256, seed=None):
+        self.y_intermediate = y_intermediate
+        self.n_samples = n_samples
+        self.share_points = share_points
+        self.label_points = label_points
+        self.label_leakage = label_leakage
+        self.noise = noise
+        self.dtype = np.dtype(dtype)
+        self.adc_scale = adc_scale
+        self.rng = np.random.default_rng(seed)
+
+    def capture_batch(self, boolean_shares):
+        boolean_shares = np.asarray(boolean_shares, dtype=np.uint32)
+        n = len(boolean_shares)
+        traces = self.rng.normal(0, self.noise, (n, self.n_samples)).astype(np.float32)
+        hamming_weights = np.unpackbits(boolean_shares.view(np.uint8).reshape(n, -1, 4), axis=2).sum(axis=2)
+        for share, point in enumerate(self.share_points[:boolean_shares.shape[1]]):
+            traces[:, point] += hamming_weights[:, share] - 16
+        traces[:, list(self.label_points)] += self.label_leakage * labels_of(boolean_shares, self.y_intermediate).reshape(-1, 1)
+        if self.dtype == np.int16:
+            return np.clip(np.round(traces * self.adc_scale), -2**15, 2**15 - 1).astype(np.int16)
+        return traces.astype(self.dtype)
+
+# Labels of 'boolean_shares': 1 if the masked value is >= y_intermediate, else 0.
+def labels_of(boolean_shares, y_intermediate):
+    y_coeff = np.bitwise_xor.reduce(np.asarray(boolean_shares, dtype=np.uint32), axis=1)
+    return (y_coeff >= y_intermediate).astype(np.uint16)
+
+# Acquire batches of 'batch_size' traces in a background thread. At most 'depth' batches
+# are buffered, i.e. the next batch is acquired while the previous one is stored.
+def acquire_batches(backend, boolean_shares, batch_size, depth=2):
+    batches = queue.Queue(maxsize=depth)
+    done = threading.Event()
+
+    def producer():
+        try:
+            for start in range(0, len(boolean_shares), batch_size):
+                if done.is_set():
+                    break
+                batch = backend.capture_batch(boolean_shares[start:start + batch_size])
+                batches.put((start, batch))
+        except Exception as err:
+            batches.put((None, err))
+        batches.put(None)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while (item := batches.get()) is not None:
+            if item[0] is None:
+                raise item[1]
+            yield item
+    finally:
+        done.set()
+        # Unblock the producer if it waits for a free buffer
+        while thread.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+# Capture traces of the b2a conversion of all rows of 'boolean_shares' with 'backend'.
+# Traces are acquired in batches of 'batch_size' (double buffered, see acquire_batches) and
+# stored as backend.dtype, e.g. float32 or int16. If 'out_dir' is given, traces and labels
+# are appended to memory-mapped .npy shards of 'shard_size' traces
+# (traces_00000.npy, labels_00000.npy, ...) instead of being kept in RAM. A shard is created
+# when its first batch arrives and the labels are written together with their traces, shards
+# of an earlier capture in 'out_dir' are removed.
+# 'on_batch(start, traces)' is called for every captured batch, capturing stops early if
+# it returns True (see capture_attack_online in capture.py). The last shard is then
+# truncated to the captured traces, so load_shards only returns captured traces.
+# Returns traces, labels (arrays, or lists of memory-mapped shards for 'out_dir') and the
+# achieved traces per second. After an early stop only the captured traces are returned.
+def capture_pipeline(backend, boolean_shares, y_intermediate, batch_size=1024, out_dir=None, shard_size=1 << 20, verbose=True, on_batch=None):
+    n = len(boolean_shares)
+    labels = labels_of(boolean_shares, y_intermediate)
+    if out_dir is None:
+        shard_size = max(n, 1)
+        trace_shards, label_shards = [np.zeros((n, backend.n_samples), dtype=backend.dtype)], [labels]
+    else:
+        os.makedirs(out_dir, exist_ok=True)
+        for f in os.listdir(out_dir):
+            if f.startswith(("traces_", "labels_")) and f.endswith(".npy"):
+                os.remove(os.path.join(out_dir, f))
+        trace_shards, label_shards = [], []
+
+    # Memory-mapped shard 'shard' of 'out_dir', created on first use
+    def shard_of(shard):
+        while len(trace_shards) <= shard:
+            size = min(shard_size, n - len(trace_shards) * shard_size)
+            trace_shards.append(np.lib.format.open_memmap(os.path.join(out_dir, f"traces_{len(trace_shards):05d}.npy"), mode='w+', dtype=backend.dtype, shape=(size, backend.n_samples)))
+            label_shards.append(np.lib.format.open_memmap(os.path.join(out_dir, f"labels_{len(label_shards):05d}.npy"), mode='w+', dtype=labels.dtype, shape=(size,)))
+        return trace_shards[shard], label_shards[shard]
+
+    t0 = time.time()
+    captured = 0
+    for start, batch in acquire_batches(backend, boolean_shares, batch_size):
+        # A batch may span two shards
+        offset = 0
+        while offset < len(batch):
+            shard, index = divmod(start + offset, shard_size)
+            count = min(len(batch) - offset, shard_size - index)
+            if out_dir is None:
+                trace_shards[0][index:index + count] = batch[offset:offset + count]
+            else:
+                traces, shard_labels = shard_of(shard)
+                traces[index:index + count] = batch[offset:offset + count]
+                shard_labels[index:index + count] = labels[start + offset:start + offset + count]
+            offset += count
+        captured += len(batch)
+        if verbose:
+            print(f"\r{captured} / {n} traces ({captured / max(time.time() - t0, 1e-9):.1f} traces/s)", end='')
+        if on_batch is not None and on_batch(start, batch):
+            break
+    rate = captured / max(time.time() - t0, 1e-9)
+    if verbose:
+        print()
+
+    if out_dir is None:
+        return trace_shards[0][:captured], labels[:captured], rate
+    for shard in trace_shards + label_shards:
+        shard.flush()
+    last = captured - (len(trace_shards) - 1) * shard_size
+    if trace_shards and last < len(trace_shards[-1]):
+        # Early stop: rewrite the last shard with its captured traces only
+        shard = len(trace_shards) - 1
+        for name, shards in (("traces", trace_shards), ("labels", label_shards)):
+            path = os.path.join(out_dir, f"{name}_{shard:05d}.npy")
+            captured_part = np.array(shards[shard][:last])
+            shards[shard] = None
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, captured_part)
+            os.replace(path + ".tmp", path)
+            shards[shard] = np.load(path, mmap_mode='r+')
+    return trace_shards, label_shards, rate
+
+# Load the shards written by capture_pipeline memory-mapped, in order.
+def load_shards(out_dir):
+    traces = sorted(f for f in os.listdir(out_dir) if f.startswith("traces_"))
+    labels = sorted(f for f in os.listdir(out_dir) if f.startswith("labels_"))
+    return [np.load(os.path.join(out_dir, f), mmap_mode='r') for f in traces], [np.load(os.path.join(out_dir, f), mmap_mode='r') for f in labels]
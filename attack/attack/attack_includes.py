@@ -0,0 +1,22 @@
+# Includes of the attack notebook (model definition, training and evaluation).
+# The helper scripts only import what they need, so that e.g. capture workers start without TensorFlow.
+import os
+import pickle
+import random
+
+import matplotlib.pyplot as plt 
+import numpy as np 
+import tensorflow as tf
+import tensorflow.keras as keras
+
+from tensorflow.keras.metrics import Precision, Recall
+from tensorflow.keras.models import Sequential
+from tensorflow.keras.layers import Conv1D, MaxPooling1D, Flatten, Dense
+from tensorflow.keras.activations import relu
+from tensorflow.python.ops.numpy_ops import np_config
+np_config.enable_numpy_behavior()
+
+from tqdm import tqdm
+
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
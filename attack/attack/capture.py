@@ -1,66 +1,83 @@
 import chipwhisperer as cw
 from helper import *
+from acquisition import *
 
 # Use the CW API to trace the execution of the b2a conversion of 'boolean_shares'.
 # If samples < n_samples are received returns array of zeros.
-def trace_b2a(scope, target, n_samples, boolean_shares):
-    t = np.zeros((n_samples))
+# With 'as_int' the raw ADC samples are returned (int16) instead of floats.
+def trace_b2a(scope, target, n_samples, boolean_shares, as_int=False):
+    t = np.zeros((n_samples), dtype=np.int16 if as_int else np.float64)
     scope.arm()
     target.simpleserial_write('o', bytearray(boolean_shares))
     ret = scope.capture()
     if ret:
         print('Timeout happened during acquisition')
     else:
-        t = scope.get_last_trace()[:n_samples]
+        t = scope.get_last_trace(as_int=as_int)[:n_samples]
     return t
 
-# Capture traces of b2a conversion of 'n_y_coeff' random boolean share 
-# pairs masking y-coefficients in the range [y_intermediate-y_range, y_intermediate+y_range[. 
-# Values < y_intermediate are labeled 0, values >= y_intermediate are labeled 1.
-def capture_profiling_traces(scope, y_intermediate=2**17, y_range=16, n_y_coeff=2000):
-    target = cw.target(scope, cw.targets.SimpleSerial, flush_on_err=False)
+# Capture backend for capture_pipeline (see acquisition.py) using the CW 'scope' and
+# the b2a firmware. Traces are float32, or int16 ADC samples with 'as_int'.
+class ChipWhispererBackend:
     # Sample 800 to 1200 correspond to the execution of the b2a conversion
     # function bewtween the surrounding nops.
-    n_samples = 400
     # 200 cycles of setup function execution including 50 nops.
-    scope.adc.offset = 800
-    # Number of coefficietns
-    n_traces = (y_range*2) * n_y_coeff
-    labels = np.zeros(n_traces, dtype=np.uint16)
-    traces = np.zeros((n_traces, n_samples))
-    boolean_shares = np.zeros(2, dtype=np.uint32)
+    def __init__(self, scope, n_samples=400, offset=800, as_int=False):
+        self.scope = scope
+        self.target = cw.target(scope, cw.targets.SimpleSerial, flush_on_err=False)
+        self.n_samples = n_samples
+        self.as_int = as_int
+        self.dtype = np.dtype(np.int16 if as_int else np.float32)
+        scope.adc.offset = offset
+
+    def capture_batch(self, boolean_shares):
+        traces = np.zeros((len(boolean_shares), self.n_samples), dtype=self.dtype)
+        for i, shares in enumerate(boolean_shares):
+            traces[i] = trace_b2a(self.scope, self.target, self.n_samples, shares, self.as_int)
+        return traces
 
-    label = 0
-    coeff_idx = 0
-    for y_coeff in tqdm(range(y_intermediate - y_range, (y_intermediate + y_range))):
-        if y_coeff == y_intermediate:
-            label = 1
-        idx = coeff_idx * n_y_coeff
-        for i in (range(n_y_coeff)):
-            boolean_shares = random_booleanshares(y_coeff, y_intermediate)                
-            labels[idx + i] = label
-            traces[idx + i] = trace_b2a(scope, target, n_samples, boolean_shares)
-        coeff_idx += 1
+# Capture traces of b2a conversion of 'n_y_coeff' random boolean share
+# pairs masking y-coefficients in the range [y_intermediate-y_range, y_intermediate+y_range[.
+# Values < y_intermediate are labeled 0, values >= y_intermediate are labeled 1.
+# 'backend' defaults to ChipWhispererBackend(scope), e.g. SimulatedBackend() runs without hardware.
+# With 'out_dir' the traces are written to memory-mapped shards, see capture_pipeline.
+# 'n_shares' and 'rng' are passed to random_booleanshares_bulk.
+def capture_profiling_traces(scope, y_intermediate=2**17, y_range=16, n_y_coeff=2000, backend=None, batch_size=1024, out_dir=None, n_shares=2, rng=None):
+    if backend is None:
+        backend = ChipWhispererBackend(scope)
+    y_coeffs = np.repeat(np.arange(y_intermediate - y_range, y_intermediate + y_range, dtype=np.uint32), n_y_coeff)
+    boolean_shares = random_booleanshares_bulk(y_coeffs, y_intermediate, n_shares, rng)
 
+    traces, labels, rate = capture_pipeline(backend, boolean_shares, y_intermediate, batch_size=batch_size, out_dir=out_dir)
+    print(f"Captured {len(boolean_shares)} traces at {rate:.1f} traces/s")
     return traces, labels
 
 # Capture traces of the b2a conversin of boolean_shares.
 # Values < y_intermediate are labeled 0, values >= y_intermediate are labeled 1.
-def capture_attack_traces(scope, boolean_shares, y_intermediate=2**17):
-    target = cw.target(scope, cw.targets.SimpleSerial, flush_on_err=False)
-    # Sample 800 to 1200 correspond to the execution of the b2a conversion
-    # function bewtween the surrounding nops.
-    n_samples = 400
-    # 200 cycles of setup function execution including 50 nops.
-    scope.adc.offset = 800
-    
-    n = len(boolean_shares)
-    labels = np.zeros((n))
-    traces = np.zeros((n, n_samples))
-         
-    for i in tqdm(range(n)):
-        y_coeff = boolean_shares[i][0] ^ boolean_shares[i][1]
-        labels[i] = (y_coeff >= y_intermediate)
-        traces[i] = trace_b2a(scope, target, n_samples, boolean_shares[i])
+# 'backend', 'batch_size' and 'out_dir' as for capture_profiling_traces.
+def capture_attack_traces(scope, boolean_shares, y_intermediate=2**17, backend=None, batch_size=1024, out_dir=None):
+    if backend is None:
+        backend = ChipWhispererBackend(scope)
+    boolean_shares = np.asarray(boolean_shares, dtype=np.uint32)
+
+    traces, labels, rate = capture_pipeline(backend, boolean_shares, y_intermediate, batch_size=batch_size, out_dir=out_dir)
+    print(f"Captured {len(boolean_shares)} traces at {rate:.1f} traces/s")
+    return traces, labels
+
+# Capture attack traces and recover the key online: every batch of traces is classified by
+# 'classifier' (scores > 'threshold' predict y>=0 like predict in helper.py) and handed to
+# 'recovery' (OnlineRecovery in recover_key.py) whose equations are in the order of
+# 'boolean_shares'. Capturing stops as soon as the recovery is done.
+# Returns the traces and labels captured so far.
+def capture_attack_online(scope, boolean_shares, recovery, classifier, threshold=0.5, y_intermediate=2**17, backend=None, batch_size=1024, out_dir=None, preprocess=None):
+    if backend is None:
+        backend = ChipWhispererBackend(scope)
+    boolean_shares = np.asarray(boolean_shares, dtype=np.uint32)
+
+    def on_batch(start, traces):
+        scores = predict_scores(classifier, traces, batch_size=len(traces), preprocess=preprocess)
+        return recovery.add_batch(start, scores > threshold)
 
+    traces, labels, rate = capture_pipeline(backend, boolean_shares, y_intermediate, batch_size=batch_size, out_dir=out_dir, on_batch=on_batch)
+    print(f"Captured {recovery.consumed} of {len(boolean_shares)} traces at {rate:.1f} traces/s")
     return traces, labels
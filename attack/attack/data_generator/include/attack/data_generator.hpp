@@ -14,6 +14,9 @@ extern "C" {
 
 // Masked Dilitthium includes
 #include "masking_interface.h"
+
+// C interface (shared library)
+#include "data_generator_api.h"
 }
 
 // Only collect equations where z_{i,j} < | tau |
@@ -83,12 +86,19 @@ namespace DataGenerator
         };
 
         void GenerateData(void);
+        // Gather aSignaturesTarget equations with y == 0 in memory, instead of writing them to mOutPath
+        DataBatch* GenerateBatch(unsigned aSignaturesTarget);
+
+        void SetThreads(unsigned aNThreads) { mNThreads = aNThreads; }
+        void SetVerbose(bool aVerbose) { mVerbose = aVerbose; }
+        void GetS1(int32_t* aS1);
 
     private:
         uint8_t mPublicKey[CRYPTO_PUBLICKEYBYTES];
         uint8_t mSecretKey[CRYPTO_SECRETKEYBYTES];
 
         std::atomic<uint32_t> mAtomicTries = 0, mZeroCoefficients = 0;
+        uint32_t mBatch = 0; // Number of SignThreads calls, mixed into the seeds of the mask randomness
         std::vector<Equation> mEquationsGlobal;
         std::mutex mEquationsMutex;
         std::mutex mSignatureMutex;
@@ -96,11 +106,14 @@ namespace DataGenerator
         int32_t mS1[L][N];
 
         const bool mMasked;
-        const unsigned mSignaturesTarget;
+        unsigned mSignaturesTarget;
         const std::string mOutPath;
         unsigned mNThreads;
+        bool mVerbose = true;
 
+        void SignThreads(void);
         void SignRandomMessages(int aThreadId);
+        DataBatch* CollectBatch(void);
         void WriteDataToNPY(void);
     };
 
@@ -0,0 +1,39 @@
+#include <stddef.h>
+#include <stdint.h>
+
+// C interface of the data generator, built as shared library (libdata_generator.so) for attack/generator.py
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+// Equations of one batch, same layout as the .npy files of the data generator executable.
+// The arrays are owned by the batch, release them with FreeBatchC.
+typedef struct {
+    size_t n;          // number of equations
+    size_t zeros;      // number of equations with y == 0
+    uint8_t* poly;     // [n]
+    uint8_t* coeff;    // [n]
+    int32_t* z;        // [n]
+    int32_t* y;        // [n]
+    int32_t* c;        // [n * N]
+    uint32_t* bs;      // [n * N_SHARES], NULL if not masked
+} DataBatch;
+
+// DILITHIUM_MODE, L, N and N_SHARES the library was built with
+void GetParamsC(int* aMode, int* aL, int* aN, int* aNShares);
+
+// Create a generator with a fresh key pair, signing with aNThreads threads
+void* CreateGeneratorC(int aMasked, unsigned aNThreads);
+void DestroyGeneratorC(void* aGenerator);
+void SetThreadsC(void* aGenerator, unsigned aNThreads);
+// Copy the secret s1 (L * N coefficients) to aS1
+void GetS1C(void* aGenerator, int32_t* aS1);
+
+// Sign random messages until aZeroCoefficientsTarget equations with y == 0 are gathered
+DataBatch* GenerateBatchC(void* aGenerator, unsigned aZeroCoefficientsTarget);
+void FreeBatchC(DataBatch* aBatch);
+
+#ifdef __cplusplus
+}
+#endif
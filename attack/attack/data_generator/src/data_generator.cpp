@@ -30,6 +30,8 @@ extern "C" {
 namespace DataGenerator
 {
     thread_local std::unique_ptr<Signature> threadlocalSignature;
+    // Mask randomness of rand32, seeded by every signing thread
+    thread_local std::mt19937 threadlocalGenerator;
 
     void DataGenerator::GenerateData(void)
     {
@@ -39,13 +41,7 @@ namespace DataGenerator
 
         auto start = std::chrono::high_resolution_clock::now();
 
-        // Generate signatures in parallel
-        std::vector<std::thread> threads(mNThreads);
-        for (int i = 0; i < threads.size(); ++i)
-            threads[i] = std::thread([this, i]
-                                     { this->SignRandomMessages(i); });
-        for (std::thread &thread : threads)
-            thread.join();
+        SignThreads();
 
         auto end = std::chrono::high_resolution_clock::now();
         auto duration = std::chrono::duration_cast<std::chrono::seconds>(end - start).count();
@@ -61,19 +57,59 @@ namespace DataGenerator
                   << "Done - data written to ./" << mOutPath << " directory!" << std::endl;
     }
 
+    DataBatch* DataGenerator::GenerateBatch(unsigned aSignaturesTarget)
+    {
+        // Start a new batch with the same key
+        mEquationsGlobal.clear();
+        mZeroCoefficients = 0;
+        mAtomicTries = 0;
+        mSignaturesTarget = aSignaturesTarget;
+
+        SignThreads();
+
+        return CollectBatch();
+    }
+
+    void DataGenerator::SignThreads(void)
+    {
+        // Generate signatures in parallel
+        mBatch++;
+        std::vector<std::thread> threads(mNThreads);
+        for (int i = 0; i < threads.size(); ++i)
+            threads[i] = std::thread([this, i]
+                                     { this->SignRandomMessages(i); });
+        for (std::thread &thread : threads)
+            thread.join();
+    }
+
+    void DataGenerator::GetS1(int32_t* aS1)
+    {
+        int idx = 0;
+        for (int l = 0; l < L; l++) {
+            for (int n = 0; n < N; n++) {
+                aS1[idx++] = mS1[l][n];
+            }
+        }
+    }
+
     void DataGenerator::SignRandomMessages(int aThreadId)
     {
         size_t smlen;
         uint8_t sm[MLEN + CRYPTO_BYTES];
         uint8_t m[MLEN + CRYPTO_BYTES];
 
+        // Threads are started anew for every batch, seed them so that no batch or thread repeats the mask randomness of another
+        std::random_device device;
+        std::seed_seq seed{device(), device(), device(), device(), mBatch, (uint32_t)aThreadId};
+        threadlocalGenerator.seed(seed);
+
         int outCount = 0;
         while (true) {
             int tries = mAtomicTries++;
             int zeros = mZeroCoefficients;
 
             // Progress report on thread 0
-            if (!aThreadId) {
+            if (!aThreadId && mVerbose) {
                 if (!(outCount++ % 500))
                     std::cout << "Signature " << zeros << " / " << mSignaturesTarget << " (Try: " << tries << ")" << std::endl;
             }
@@ -116,6 +152,41 @@ namespace DataGenerator
         }
     }
 
+    DataBatch* DataGenerator::CollectBatch(void)
+    {
+        size_t n = mEquationsGlobal.size();
+
+        DataBatch* batch = (DataBatch*) malloc(sizeof(DataBatch));
+        batch->n = n;
+        batch->zeros = mZeroCoefficients;
+        batch->poly = (uint8_t*) malloc(n * sizeof(uint8_t));
+        batch->coeff = (uint8_t*) malloc(n * sizeof(uint8_t));
+        batch->z = (int32_t*) malloc(n * sizeof(int32_t));
+        batch->y = (int32_t*) malloc(n * sizeof(int32_t));
+        batch->c = (int32_t*) malloc(n * N * sizeof(int32_t));
+        batch->bs = mMasked ? (uint32_t*) malloc(n * N_SHARES * sizeof(uint32_t)) : NULL;
+
+        for (int i = 0; i < n; i++) {
+            Equation& eq = mEquationsGlobal[i];
+            batch->z[i] = eq.z;
+            batch->y[i] = eq.y;
+            batch->poly[i] = eq.poly;
+            batch->coeff[i] = eq.coeff;
+
+            for (int l = 0; l < N; l++) {
+                batch->c[i * N + l] = eq.c[l];
+            }
+
+            if (mMasked) {
+                for (int l = 0; l < N_SHARES; l++) {
+                    batch->bs[i * N_SHARES + l] = eq.bs[l];
+                }
+            }
+        }
+
+        return batch;
+    }
+
     void DataGenerator::WriteDataToNPY(void)
     {
         if (std::filesystem::exists("./" + mOutPath))
@@ -132,46 +203,18 @@ namespace DataGenerator
         k.shape = { CRYPTO_SECRETKEYBYTES };
         npy::write_npy(mOutPath + "/sk.npy", k); */
 
-        size_t n = mEquationsGlobal.size();
-
-        uint8_t* poly = (uint8_t*) malloc(n * sizeof(uint8_t));
-        uint8_t* coeff = (uint8_t*) malloc(n * sizeof(uint8_t));
-        int32_t* z = (int32_t*) malloc(n * sizeof(int32_t));
-        int32_t* y = (int32_t*) malloc(n * sizeof(int32_t));
-        int32_t* c = (int32_t*) malloc(n * N * sizeof(int32_t));
-        uint32_t* bs = (uint32_t*) malloc(n * N_SHARES * sizeof(uint32_t));
+        DataBatch* batch = CollectBatch();
+        size_t n = batch->n;
 
         int32_t* s1 = (int32_t*) malloc(L * N * sizeof(int32_t));
-
-        for (int i = 0; i < n; i++) {
-            Equation& eq = mEquationsGlobal[i];
-            z[i] = eq.z;
-            y[i] = eq.y;
-            poly[i] = eq.poly;
-            coeff[i] = eq.coeff;
-
-            for (int l = 0; l < N; l++) {
-                c[i * N + l] = eq.c[l];
-            }
-
-            for (int l = 0; l < N_SHARES; l++) {
-                bs[i * N_SHARES + l] = eq.bs[l];
-            }
-        }
-
-        int idx = 0;
-        for (int l = 0; l < L; l++) {
-            for (int n = 0; n < N; n++) {
-                s1[idx++] = mS1[l][n];
-            }
-        }
+        GetS1(s1);
 
         // Write polynomial indices
-        k.data_ptr = poly;
+        k.data_ptr = batch->poly;
         k.shape = { n };
         npy::write_npy(mOutPath + "/poly.npy", k);
         // Write coefficient indices
-        k.data_ptr = coeff;
+        k.data_ptr = batch->coeff;
         k.shape = { n };
         npy::write_npy(mOutPath + "/coeff.npy", k);
 
@@ -181,33 +224,28 @@ namespace DataGenerator
         d.shape = { L, N };
         npy::write_npy(mOutPath + "/s1.npy", d);
         // Write c data
-        d.data_ptr = c;
+        d.data_ptr = batch->c;
         d.shape = { n, N };
         npy::write_npy(mOutPath + "/c.npy", d);
         // Write y data
-        d.data_ptr = y;
+        d.data_ptr = batch->y;
         d.shape = { n };
         npy::write_npy(mOutPath + "/y.npy", d);
         // Write z data
-        d.data_ptr = z;
+        d.data_ptr = batch->z;
         d.shape = { n };
         npy::write_npy(mOutPath + "/z.npy", d);
 
         npy::npy_data_ptr<uint32_t> b;
         if (mMasked) {
             // Write boolean shares data
-            b.data_ptr = bs;
+            b.data_ptr = batch->bs;
             b.shape = {n, N_SHARES};
             npy::write_npy(mOutPath + "/bs.npy", b);
         }
 
-        free(c);
-        free(coeff);
-        free(poly);
         free(s1);
-        free(y);
-        free(z);
-        free(bs);
+        FreeBatchC(batch);
     }
 
     void Signature::GatherEquations(poly *aC, polyvecl *aY, polyvecl *aZ)
@@ -265,9 +303,8 @@ namespace DataGenerator
 
         uint32_t rand32(void)
         {
-            static thread_local std::mt19937 gen;
             std::uniform_int_distribution<uint32_t> dist(0, UINT32_MAX);
-            return dist(gen);
+            return dist(threadlocalGenerator);
         }
 
         uint16_t rand16(void)
@@ -282,6 +319,57 @@ namespace DataGenerator
     }
 }
 
+extern "C" {
+    void GetParamsC(int* aMode, int* aL, int* aN, int* aNShares)
+    {
+        *aMode = DILITHIUM_MODE;
+        *aL = L;
+        *aN = N;
+        *aNShares = N_SHARES;
+    }
+
+    void* CreateGeneratorC(int aMasked, unsigned aNThreads)
+    {
+        DataGenerator::DataGenerator* generator = new DataGenerator::DataGenerator(aMasked, 0, "", aNThreads);
+        generator->SetVerbose(false);
+        return generator;
+    }
+
+    void DestroyGeneratorC(void* aGenerator)
+    {
+        delete (DataGenerator::DataGenerator*) aGenerator;
+    }
+
+    void SetThreadsC(void* aGenerator, unsigned aNThreads)
+    {
+        ((DataGenerator::DataGenerator*) aGenerator)->SetThreads(aNThreads);
+    }
+
+    void GetS1C(void* aGenerator, int32_t* aS1)
+    {
+        ((DataGenerator::DataGenerator*) aGenerator)->GetS1(aS1);
+    }
+
+    DataBatch* GenerateBatchC(void* aGenerator, unsigned aZeroCoefficientsTarget)
+    {
+        return ((DataGenerator::DataGenerator*) aGenerator)->GenerateBatch(aZeroCoefficientsTarget);
+    }
+
+    void FreeBatchC(DataBatch* aBatch)
+    {
+        free(aBatch->poly);
+        free(aBatch->coeff);
+        free(aBatch->z);
+        free(aBatch->y);
+        free(aBatch->c);
+        free(aBatch->bs);
+        free(aBatch);
+    }
+}
+
+// The shared library (DATA_GENERATOR_LIBRARY) only exports the C interface
+#ifndef DATA_GENERATOR_LIBRARY
+
 int main(int argc, char* argv[]) {
     if (argc < 4 || argc > 5) {
         std::cout << "###### DataGenerator for " << "Dilithium (Mode: " << DILITHIUM_MODE << ") ######" << std::endl;
@@ -300,3 +388,4 @@ int main(int argc, char* argv[]) {
 
     return 0;
 }
+#endif
@@ -0,0 +1,160 @@
+import ctypes
+import os
+import queue
+import threading
+import weakref
+
+import numpy as np
+
+# In-process interface to the signature data generator (data_generator/src/data_generator.cpp).
+# Build the shared library with data_generator/build.sh, it is found next to the executable at
+# data_generator/build/src/libdata_generator.so. The batches have the same content as the .npy files
+# written by the executable and read by load_data in recover_key.py, but are never written to disk.
+DEFAULT_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_generator', 'build', 'src', 'libdata_generator.so')
+
+# Mirror of DataBatch in data_generator/include/attack/data_generator_api.h
+class _DataBatch(ctypes.Structure):
+    _fields_ = [('n', ctypes.c_size_t),
+                ('zeros', ctypes.c_size_t),
+                ('poly', ctypes.POINTER(ctypes.c_uint8)),
+                ('coeff', ctypes.POINTER(ctypes.c_uint8)),
+                ('z', ctypes.POINTER(ctypes.c_int32)),
+                ('y', ctypes.POINTER(ctypes.c_int32)),
+                ('c', ctypes.POINTER(ctypes.c_int32)),
+                ('bs', ctypes.POINTER(ctypes.c_uint32))]
+
+_LIBRARIES = {}
+
+# Load the shared library at 'path' (default: DEFAULT_LIBRARY) and declare the C interface.
+# ctypes releases the GIL during the calls, so Python threads keep running while signing.
+def load_library(path=None):
+    path = os.path.abspath(path or DEFAULT_LIBRARY)
+    if path in _LIBRARIES:
+        return _LIBRARIES[path]
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f'{path} does not exist, build it with data_generator/build.sh')
+    lib = ctypes.CDLL(path)
+    lib.GetParamsC.argtypes = [ctypes.POINTER(ctypes.c_int)] * 4
+    lib.GetParamsC.restype = None
+    lib.CreateGeneratorC.argtypes = [ctypes.c_int, ctypes.c_uint]
+    lib.CreateGeneratorC.restype = ctypes.c_void_p
+    lib.DestroyGeneratorC.argtypes = [ctypes.c_void_p]
+    lib.DestroyGeneratorC.restype = None
+    lib.SetThreadsC.argtypes = [ctypes.c_void_p, ctypes.c_uint]
+    lib.SetThreadsC.restype = None
+    lib.GetS1C.argtypes = [ctypes.c_void_p, np.ctypeslib.ndpointer(np.int32, flags='C_CONTIGUOUS')]
+    lib.GetS1C.restype = None
+    lib.GenerateBatchC.argtypes = [ctypes.c_void_p, ctypes.c_uint]
+    lib.GenerateBatchC.restype = ctypes.POINTER(_DataBatch)
+    lib.FreeBatchC.argtypes = [ctypes.POINTER(_DataBatch)]
+    lib.FreeBatchC.restype = None
+    _LIBRARIES[path] = lib
+    return lib
+
+# Parameters the library was built with: DILITHIUM_MODE, L, N and N_SHARES
+def library_params(lib):
+    params = [ctypes.c_int() for _ in range(4)]
+    lib.GetParamsC(*[ctypes.byref(p) for p in params])
+    return tuple(p.value for p in params)
+
+# NumPy view of 'count' elements of type 'ctype' at 'pointer' without copying. The view keeps
+# 'owner' alive, i.e. the memory of the batch is freed once all its arrays are garbage.
+def _view(pointer, ctype, shape, owner):
+    count = int(np.prod(shape))
+    if count == 0 or not pointer:
+        return np.empty(shape, dtype=np.dtype(ctype))
+    buffer = (ctype * count).from_address(ctypes.addressof(pointer.contents))
+    buffer.owner = owner
+    return np.frombuffer(buffer, dtype=np.dtype(ctype)).reshape(shape)
+
+# Owns the memory of one batch of the library
+class _BatchMemory:
+    def __init__(self, lib, batch):
+        self.finalizer = weakref.finalize(self, lib.FreeBatchC, batch)
+
+# Generates signature data of a fresh key pair in the current process with 'threads' signing
+# threads. 'mode' (DILITHIUM_MODE 2, 3 or 5) is checked against the library, the library has
+# to be built per mode, see 'library'.
+class SignatureGenerator:
+    def __init__(self, masked=True, threads=1, library=None, mode=None):
+        self.lib = load_library(library)
+        self.mode, self.L, self.N, self.n_shares = library_params(self.lib)
+        if mode is not None and mode != self.mode:
+            raise ValueError(f'library is built for DILITHIUM_MODE {self.mode}, not {mode}')
+        if threads < 1:
+            raise ValueError('threads must be at least 1')
+        self.masked = masked
+        self._threads = threads
+        self._handle = self.lib.CreateGeneratorC(int(masked), threads)
+        self._finalizer = weakref.finalize(self, self.lib.DestroyGeneratorC, self._handle)
+        self.s1 = np.empty((self.L, self.N), dtype=np.int32)
+        self.lib.GetS1C(self._handle, self.s1)
+
+    @property
+    def threads(self):
+        return self._threads
+
+    @threads.setter
+    def threads(self, threads):
+        if threads < 1:
+            raise ValueError('threads must be at least 1')
+        self.lib.SetThreadsC(self._handle, threads)
+        self._threads = threads
+
+    # Sign random messages until 'zero_target' equations with y == 0 are gathered.
+    # Returns s1, y, z, c, bs, poly, coeff like load_data in recover_key.py (bs = [] if not masked).
+    # The arrays are read-only views of the memory of the library, copy them to modify them.
+    def generate(self, zero_target):
+        batch = self.lib.GenerateBatchC(self._handle, zero_target)
+        memory = _BatchMemory(self.lib, batch)
+        b = batch.contents
+        n = b.n
+        arrays = {
+            'y': _view(b.y, ctypes.c_int32, (n,), memory),
+            'z': _view(b.z, ctypes.c_int32, (n,), memory),
+            'c': _view(b.c, ctypes.c_int32, (n, self.N), memory),
+            'poly': _view(b.poly, ctypes.c_uint8, (n,), memory),
+            'coeff': _view(b.coeff, ctypes.c_uint8, (n,), memory),
+        }
+        arrays['bs'] = _view(b.bs, ctypes.c_uint32, (n, self.n_shares), memory) if self.masked else []
+        for array in arrays.values():
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+        return self.s1, arrays['y'], arrays['z'], arrays['c'], arrays['bs'], arrays['poly'], arrays['coeff']
+
+    # Stream 'n_batches' batches (endless if None) of 'zero_target' equations with y == 0 each,
+    # all of the same key. The next batch is generated in a background thread while the previous
+    # one is processed (at most 'depth' batches buffered).
+    def batches(self, zero_target, n_batches=None, depth=1):
+        batches = queue.Queue(maxsize=depth)
+        done = threading.Event()
+
+        # Similar to acquire_batches in acquisition.py
+        def producer():
+            try:
+                count = 0
+                while not done.is_set() and (n_batches is None or count < n_batches):
+                    batches.put((count, self.generate(zero_target)))
+                    count += 1
+            except Exception as err:
+                batches.put((None, err))
+            batches.put(None)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while (item := batches.get()) is not None:
+                if item[0] is None:
+                    raise item[1]
+                yield item[1]
+        finally:
+            done.set()
+            # Unblock the producer if it waits for a free buffer
+            while thread.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self._finalizer()
@@ -1,67 +1,66 @@
-import os
-import pickle
-import random
-
-import matplotlib.pyplot as plt 
 import numpy as np 
-import tensorflow as tf
-import tensorflow.keras as keras
 
-from tensorflow.keras.metrics import Precision, Recall
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Conv1D, MaxPooling1D, Flatten, Dense
-from tensorflow.keras.activations import relu
-from tensorflow.python.ops.numpy_ops import np_config
-np_config.enable_numpy_behavior()
+# Heavy dependencies (scalib, matplotlib) are imported by the functions that use them,
+# the notebook imports TensorFlow and sklearn via attack_includes.py.
+
+# Fit a Quantizer in chunks of 'chunk_size' traces, equal to Quantizer.fit(traces) with
+# the default bounds method. 'traces' may be memory-mapped.
+def fit_quantizer(traces, chunk_size=10_000, margin=4.0):
+    from scalib.preprocessing import Quantizer
+    lower = upper = None
+    for start in range(0, len(traces), chunk_size):
+        chunk = np.asarray(traces[start:start + chunk_size])
+        lower = chunk.min(axis=0) if lower is None else np.minimum(lower, chunk.min(axis=0))
+        upper = chunk.max(axis=0) if upper is None else np.maximum(upper, chunk.max(axis=0))
+    return Quantizer((upper + lower) / 2, 2**15 / ((upper - lower) / 2) / margin)
+
+# Class means, univariate t-test and SNR for 'traces' and corresponding binary 'labels',
+# updated chunk by chunk so that 'traces' (e.g. memory-mapped .npy) never has to be in RAM.
+# One pass fits the quantizer (skipped if 'quantizer' is given), one pass updates the
+# accumulators. Returns the same values as analyse_traces.
+def trace_statistics(traces, labels, chunk_size=10_000, quantizer=None):
+    from scalib.metrics import Ttest, SNR
+    if quantizer is None:
+        quantizer = fit_quantizer(traces, chunk_size)
+
+    n_samples = len(traces[0])
+    sums = np.zeros((2, n_samples))
+    counts = np.zeros(2, dtype=np.int64)
+    ttest = Ttest(d=1)
+    snrobj = SNR(2, use_64bit=True)
+    for start in range(0, len(traces), chunk_size):
+        chunk = np.asarray(traces[start:start + chunk_size])
+        chunk_labels = np.asarray(labels[start:start + chunk_size]).astype(np.uint16)
 
-from tqdm import tqdm
+        # Mean of power trace groups y<0 and y>=0
+        for label in (0, 1):
+            sums[label] += chunk[chunk_labels == label].sum(axis=0)
+            counts[label] += np.count_nonzero(chunk_labels == label)
 
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
+        # T-test and SNR
+        quantized_chunk = quantizer.quantize(chunk)
+        ttest.fit_u(quantized_chunk, chunk_labels)
+        snrobj.fit_u(quantized_chunk, chunk_labels.reshape(-1, 1))
 
-from scalib.preprocessing import Quantizer
-from scalib.metrics import Ttest, SNR
+    trace_class_0, trace_class_1 = sums / counts.reshape(-1, 1)
+    return trace_class_0, trace_class_1, snrobj.get_snr()[0], ttest.get_ttest()[0]
 
 # Ttest, Power Trace and SNR analysis and plot for input 'traces' and corresponding 'labels'
-def analyse_traces(traces, labels):
+# Traces are processed in chunks of 'chunk_size' traces, see trace_statistics.
+def analyse_traces(traces, labels, chunk_size=10_000):
+    import matplotlib.pyplot as plt
     n_shares = 2
     n_traces = len(traces)
-    n_samples = len(traces[1])
-
-    trace_class_0 = np.zeros((n_traces, n_samples), dtype=np.int16) 
-    trace_class_1 = np.zeros((n_traces, n_samples), dtype=np.int16)
-
-    # Mean of power trace groups y<0 and y>=0
-    trace_class_0 = np.mean(traces[labels == 0], axis=0)
-    trace_class_1 = np.mean(traces[labels == 1], axis=0)
-    
-    #T-test
-    quantizer = Quantizer.fit(traces)
-    quantized_traces = quantizer.quantize(traces)
-    
-    ttest = Ttest(d=1)
-    ttest.fit_u(quantized_traces, labels)
-    t_univariate = ttest.get_ttest()
 
-    # SNR
-    label_snr = labels.reshape(n_traces,1)
-    snrobj = SNR(2, use_64bit=True)
-    snrobj.fit_u(quantized_traces.astype(np.int16),label_snr.astype(np.uint16))
-    snr_val = snrobj.get_snr()[0]
+    trace_class_0, trace_class_1, snr_val, t_univariate = trace_statistics(traces, labels, chunk_size)
 
-    # T-ritical value of +-4 (p-value < 0.00001)
-    upper_threshold=np.zeros(24_000,dtype=np.int16)
-    lower_threshold=np.zeros(24_000,dtype=np.int16)
-    for i in range(24_000):
-        upper_threshold[i] = 4
-        lower_threshold[i] = -4
-    
     # Create a grid of subplots with 2 rows and 1 column
     fig, axs = plt.subplots(3, 1, figsize=(10, 10))
 
-    axs[0].plot(t_univariate[0], color='red', label='Univariate t-Test')
-    axs[0].plot(upper_threshold[:n_samples], color='blue')  
-    axs[0].plot(lower_threshold[:n_samples], color='blue') 
+    axs[0].plot(t_univariate, color='red', label='Univariate t-Test')
+    # T-ritical value of +-4 (p-value < 0.00001)
+    axs[0].axhline(4, color='blue')
+    axs[0].axhline(-4, color='blue')
 
     axs[1].plot(trace_class_0, color='blue', label='mean power trace for y<0')
     axs[1].plot(trace_class_1, color='red', label='mean power trace for y>=0')
@@ -78,49 +77,90 @@ def analyse_traces(traces, labels):
     # Show the plot
     plt.show()
 
-    return trace_class_0, trace_class_1, snr_val, t_univariate[0]
+    return trace_class_0, trace_class_1, snr_val, t_univariate
 
 # Return two random booleanshares masking the specified value 'y_coeff'
 # in gamma_1 max range y_intermediate*2 = (2: 2**18, 3: 2**20, 5: 2**20).
 def random_booleanshares(y_coeff, y_intermediate):
-    n_shares = 2
-    tmp = np.zeros(n_shares, dtype=np.uint32)
-    for i in range(n_shares - 1):
-        tmp[i] = (np.random.randint(np.iinfo(np.uint32).max, dtype=np.uint32)) % (y_intermediate*2)
-        tmp[n_shares - 1] ^= tmp[i]
-    tmp[n_shares - 1] ^= y_coeff
-    return tmp
+    return random_booleanshares_bulk([y_coeff], y_intermediate)[0]
+
+# Return an (N, n_shares) array of random booleanshares masking each of the N values
+# 'y_coeffs', the masks are uniform in [0, y_intermediate*2[ as for random_booleanshares.
+# 'rng' is a seed or np.random.Generator for reproducible shares, if None the global
+# np.random state is used.
+def random_booleanshares_bulk(y_coeffs, y_intermediate, n_shares=2, rng=None):
+    y_coeffs = np.asarray(y_coeffs, dtype=np.uint32)
+    size = (len(y_coeffs), n_shares - 1)
+    if rng is None:
+        masks = np.random.randint(y_intermediate*2, size=size, dtype=np.uint32)
+    else:
+        masks = np.random.default_rng(rng).integers(y_intermediate*2, size=size, dtype=np.uint32)
+    shares = np.empty((len(y_coeffs), n_shares), dtype=np.uint32)
+    shares[:, :-1] = masks
+    shares[:, -1] = np.bitwise_xor.reduce(masks, axis=1) ^ y_coeffs
+    return shares
+
+# Run 'classifier' on 'traces' in batches of 'batch_size' traces and return the scores.
+# 'traces' may be memory-mapped (np.load(..., mmap_mode='r')), only one batch is read at a time.
+# 'preprocess' is applied per batch, e.g. scaler.transform.
+def predict_scores(classifier, traces, batch_size=65536, preprocess=None):
+    scores = np.empty(len(traces), dtype=np.float32)
+    for start in range(0, len(traces), batch_size):
+        batch = np.asarray(traces[start:start + batch_size])
+        if preprocess is not None:
+            batch = preprocess(batch)
+        scores[start:start + len(batch)] = np.asarray(classifier.predict(batch)).reshape(-1)
+    return scores
+
+# Count TP, FP, TN, FN of 'scores' > 'thresholds' against binary 'labels' for all
+# thresholds at once. Returns four arrays with one entry per threshold.
+def confusion_counts(scores, labels, thresholds):
+    labels = np.asarray(labels).astype(bool)
+    thresholds = np.atleast_1d(thresholds)
+    positive = np.sort(np.asarray(scores)[labels])
+    negative = np.sort(np.asarray(scores)[~labels])
+    tp = len(positive) - np.searchsorted(positive, thresholds, side='right')
+    fp = len(negative) - np.searchsorted(negative, thresholds, side='right')
+    return tp, fp, len(negative) - fp, len(positive) - tp
+
+# Rates of confusion counts. Undefined rates (division by zero) are 0. The contamination
+# is the share of wrongly selected equations 1 - precision, i.e. the CILWE concealment rate.
+def confusion_rates(tp, fp, tn, fn):
+    def ratio(a, b):
+        a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+        return np.divide(a, b, out=np.zeros(np.broadcast(a, b).shape), where=b != 0)
+    return {
+        'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn,
+        'accuracy': ratio(np.add(tp, tn), np.add(np.add(tp, tn), np.add(fp, fn))),
+        'precision': ratio(tp, np.add(tp, fp)),
+        'tpr': ratio(tp, np.add(tp, fn)),
+        'fpr': ratio(fp, np.add(tn, fp)),
+        'contamination': ratio(fp, np.add(tp, fp)),
+    }
+
+# Stream 'traces' through 'classifier' in batches and evaluate all decision 'thresholds'
+# in one pass without keeping the scores. Returns confusion_rates with one entry per
+# threshold, i.e. the TPR/FPR curve and the resulting contamination rate.
+def evaluate_thresholds(classifier, traces, labels, thresholds, batch_size=65536, preprocess=None):
+    thresholds = np.atleast_1d(thresholds)
+    counts = np.zeros((4, len(thresholds)), dtype=np.int64)
+    for start in range(0, len(traces), batch_size):
+        scores = predict_scores(classifier, traces[start:start + batch_size], batch_size, preprocess)
+        counts += confusion_counts(scores, np.asarray(labels[start:start + batch_size]), thresholds)
+    return confusion_rates(*counts)
 
 # Use 'classifier' to predict labels of 'traces', evaluate for decision
 # threshold of 'threshold' if prediction matches 'labels'.
-def predict(classifier, traces, labels, threshold=0.5):
-    prediction = (classifier.predict(traces).flatten() > threshold).astype(int)
-    
-    tp = 0
-    fp = 0
-    fn = 0
-    tn = 0
-    for i in range(len(labels)):
-        if labels[i] == 1:
-            if prediction[i] == 1:
-                tp += 1
-            else:
-                fn += 1
-        else:
-            if prediction[i] == 0:
-                tn += 1
-            else:
-                fp += 1
-
-    acc = (tp+tn)/ (tp+tn+fp+fn)
-    prec = (tp)/ (tp+fp)
-    fpr = (fp)/ (tn+fp)
-    tpr = (tp)/ (tp+fn)
-
-    print(f"TP: {tp} FP: {fp} TN: {tn} FN: {fn}")
-    print(f"Accuracy: {acc}")
-    print(f"Precision: {prec}")
-    print(f"TPR: {tpr}")
-    print(f"FPR: {fpr}")
+def predict(classifier, traces, labels, threshold=0.5, batch_size=65536, preprocess=None):
+    scores = predict_scores(classifier, traces, batch_size, preprocess)
+    prediction = (scores > threshold).astype(int)
+
+    rates = confusion_rates(*(int(count[0]) for count in confusion_counts(scores, labels, threshold)))
+
+    print(f"TP: {rates['tp']} FP: {rates['fp']} TN: {rates['tn']} FN: {rates['fn']}")
+    print(f"Accuracy: {rates['accuracy']}")
+    print(f"Precision: {rates['precision']}")
+    print(f"TPR: {rates['tpr']}")
+    print(f"FPR: {rates['fpr']}")
 
     return prediction
@@ -0,0 +1,214 @@
+"""
+Live metrics of long running experiments: counters with their rates, gauges, histograms and the progress of cells with their ETA
+
+	from metrics import METRICS
+	METRICS.start(port = 8000, path = 'metrics.json')
+	METRICS.inc('runs', method = 'cauchy')
+	METRICS.observe('solver_seconds', runtime, method = 'cauchy')
+	METRICS.progress('cell', done, total, method = 'cauchy', p = 0.1)
+
+start serves the Prometheus text format on http://host:port/metrics and the same as JSON on /metrics.json,
+and writes the JSON to path every interval seconds (and at exit). Nothing is exported before start is called,
+so the functions can always update METRICS. Only the standard library is used.
+
+simulation_umts24, regression and attack/attack each have an identical copy, so that every component runs on its own.
+Change all three.
+"""
+import os
+import json
+import time
+import atexit
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NAMESPACE = 'cilwe' # prefix of the Prometheus names
+RATE_WINDOW = 60 # seconds over which the rates of the counters are computed
+FLUSH_INTERVAL = 10 # seconds between two writes of the JSON file
+BUCKETS = (0.01, 0.1, 1, 10, 60, 600, 3600) # upper bounds of the histogram buckets (seconds)
+
+def _key(name, labels):
+	"""key of a metric in the registry, labels are sorted and converted to strings"""
+	return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _labels(labels, extra = ()):
+	"""Prometheus label set {k="v",...} of a key"""
+	pairs = list(labels) + list(extra)
+	if not pairs: return ''
+	escape = lambda v: v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+	return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+def _value(value):
+	"""Prometheus sample value, NaN if unknown"""
+	return 'NaN' if value is None else repr(float(value))
+
+class Metrics():
+	"""thread-safe registry of the metrics of one process"""
+
+	def __init__(self, namespace = NAMESPACE):
+		self.namespace = namespace
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.counters, self.gauges, self.histograms, self.cells = {}, {}, {}, {}
+		self.history = deque() # (time, counters) of the last snapshots for the rates
+		self.server = None
+		self.stopped = threading.Event()
+
+	def inc(self, name, value = 1, **labels):
+		"""increase the counter name by value"""
+		key = _key(name, labels)
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def set(self, name, value, **labels):
+		"""set the gauge name to value"""
+		with self.lock:
+			self.gauges[_key(name, labels)] = value
+
+	def observe(self, name, value, **labels):
+		"""add value (e.g. a duration in seconds) to the histogram name"""
+		key = _key(name, labels)
+		with self.lock:
+			histogram = self.histograms.setdefault(key, dict(count = 0, sum = 0., buckets = [0] * len(BUCKETS)))
+			histogram['count'] += 1
+			histogram['sum'] += value
+			for i, bound in enumerate(BUCKETS):
+				if value <= bound: histogram['buckets'][i] += 1
+
+	@contextmanager
+	def timer(self, name, **labels):
+		"""observe the duration of the with block in the histogram name"""
+		start = time.time()
+		try:
+			yield
+		finally:
+			self.observe(name, time.time() - start, **labels)
+
+	def progress(self, name, done, total, **labels):
+		"""progress of a cell, e.g. the runs of one (method, p)
+
+		the ETA is extrapolated from the rate since the first call for the cell. The cell restarts if done decreases or total changes,
+		so e.g. a resumed run or the next m of a bisection only count their own rate.
+		"""
+		key = _key(name, labels)
+		now = time.time()
+		with self.lock:
+			cell = self.cells.get(key)
+			if cell is None or done < cell['done'] or total != cell['total']:
+				cell = self.cells[key] = dict(start = now, done_start = done)
+			cell.update(done = done, total = total, time = now)
+
+	def _rates(self, now):
+		"""rates of all counters over the last RATE_WINDOW seconds (since the start if younger), the caller holds the lock"""
+		self.history.append((now, dict(self.counters)))
+		while len(self.history) > 1 and now - self.history[1][0] >= RATE_WINDOW:
+			self.history.popleft()
+		then, old = self.history[0]
+		if then >= now:
+			then, old = self.started, {}
+		return {key: (value - old.get(key, 0)) / max(now - then, 1e-9) for key, value in self.counters.items()}
+
+	def snapshot(self):
+		"""all metrics as a dictionary of lists, see the README"""
+		now = time.time()
+		with self.lock:
+			rates = self._rates(now)
+			counters = [dict(name = name, labels = dict(labels), value = value, rate = rates[(name, labels)]) for (name, labels), value in self.counters.items()]
+			gauges = [dict(name = name, labels = dict(labels), value = value) for (name, labels), value in self.gauges.items()]
+			histograms = [dict(name = name, labels = dict(labels), count = h['count'], sum = h['sum'], mean = h['sum'] / h['count'], buckets = dict(zip(map(str, BUCKETS), h['buckets'])))
+				for (name, labels), h in self.histograms.items()]
+			progress = []
+			for (name, labels), cell in self.cells.items():
+				rate = (cell['done'] - cell['done_start']) / (cell['time'] - cell['start']) if cell['time'] > cell['start'] else 0
+				eta = 0 if cell['done'] >= cell['total'] else (cell['total'] - cell['done']) / rate if rate > 0 else None
+				progress.append(dict(name = name, labels = dict(labels), done = cell['done'], total = cell['total'], rate = rate, eta = eta))
+		return dict(time = now, uptime = now - self.started, counters = counters, gauges = gauges, histograms = histograms, progress = progress)
+
+	def prometheus(self):
+		"""all metrics in the Prometheus text format, counters also with their rate as gauge <name>_per_second"""
+		snapshot = self.snapshot()
+		families = {}
+		def sample(name, kind, labels, value):
+			name = f'{self.namespace}_{name}'
+			families.setdefault((name, kind), []).append(f'{name}{_labels(sorted(labels.items()))} {_value(value)}')
+		for c in snapshot['counters']:
+			sample(f'{c["name"]}_total', 'counter', c['labels'], c['value'])
+			sample(f'{c["name"]}_per_second', 'gauge', c['labels'], c['rate'])
+		for g in snapshot['gauges']:
+			sample(g['name'], 'gauge', g['labels'], g['value'])
+		for p in snapshot['progress']:
+			sample(f'{p["name"]}_done', 'gauge', p['labels'], p['done'])
+			sample(f'{p["name"]}_target', 'gauge', p['labels'], p['total'])
+			sample(f'{p["name"]}_eta_seconds', 'gauge', p['labels'], p['eta'])
+		lines = []
+		for (name, kind), samples in sorted(families.items()):
+			lines += [f'# TYPE {name} {kind}'] + samples
+		for h in sorted(snapshot['histograms'], key = lambda h: h['name']):
+			name, labels = f'{self.namespace}_{h["name"]}', sorted(h['labels'].items())
+			if f'# TYPE {name} histogram' not in lines:
+				lines.append(f'# TYPE {name} histogram')
+			lines += [f'{name}_bucket{_labels(labels, [("le", bound)])} {count}' for bound, count in h['buckets'].items()]
+			lines += [f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {h["count"]}', f'{name}_sum{_labels(labels)} {_value(h["sum"])}', f'{name}_count{_labels(labels)} {h["count"]}']
+		return '\n'.join(lines) + '\n'
+
+	def flush(self, path):
+		"""write the snapshot as JSON to path, readers never see a partial file"""
+		tmp = f'{path}.{os.getpid()}.tmp'
+		with open(tmp, 'w') as f:
+			json.dump(self.snapshot(), f, indent = 1)
+		os.replace(tmp, path)
+
+	def serve(self, port, host = '127.0.0.1'):
+		"""serve /metrics (Prometheus text) and /metrics.json in a background thread"""
+		metrics = self
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path == '/metrics':
+					body, kind = metrics.prometheus().encode(), 'text/plain; version=0.0.4'
+				elif self.path == '/metrics.json':
+					body, kind = json.dumps(metrics.snapshot()).encode(), 'application/json'
+				else:
+					self.send_error(404)
+					return
+				self.send_response(200)
+				self.send_header('Content-Type', kind)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, *args):
+				# no log line for every scrape
+				pass
+
+		self.server = ThreadingHTTPServer((host, port), Handler)
+		threading.Thread(target = self.server.serve_forever, daemon = True).start()
+
+	def start(self, port = None, path = None, interval = FLUSH_INTERVAL, host = '127.0.0.1'):
+		"""serve the metrics on port (if given) and write them to path every interval seconds (if given)
+
+		the experiment continues without endpoint if the port is in use
+		"""
+		if port is not None:
+			try:
+				self.serve(port, host)
+			except OSError as e:
+				print(f'metrics are not served on port {port}: {e}')
+		if path is not None:
+			def flusher():
+				while not self.stopped.wait(interval):
+					self.flush(path)
+			threading.Thread(target = flusher, daemon = True).start()
+		atexit.register(self.stop, path)
+		return self
+
+	def stop(self, path = None):
+		"""stop serving and flushing, a last snapshot is written to path"""
+		self.stopped.set()
+		if self.server is not None:
+			self.server.shutdown()
+			self.server = None
+		if path is not None:
+			self.flush(path)
+
+METRICS = Metrics()
@@ -1,10 +1,15 @@
+import os
+import sys
+import time
 import numpy as np
 import argparse
-import cvxpy as cvx
 
-from sklearn.linear_model import LinearRegression, HuberRegressor
 from tqdm import tqdm
-from scipy.linalg import toeplitz
+from metrics import METRICS
+
+# The compact challenge format is shared with the UMTS24 simulation (simulation_umts24/equations.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'simulation_umts24'))
+from equations import compress_challenges, expand_dense
 
 # Load data generator signature data
 def load_data(file_path):
@@ -13,7 +18,8 @@ def load_data(file_path):
         s1 = np.load(file_path + 's1.npy')
         y = np.load(file_path + 'y.npy')
         z = np.load(file_path + 'z.npy')
-        c = np.load(file_path + 'c.npy')
+        # c is either dense (n_samples, N) or compact (n_samples, tau), see compress_challenges
+        c = np.load(file_path + 'c.npy', mmap_mode='r')
         poly = np.load(file_path + 'poly.npy')
         coeff = np.load(file_path + 'coeff.npy')
         try:
@@ -24,21 +30,20 @@ def load_data(file_path):
     except Exception as e:
         print(f"An error occurred: {e}")
 
-# Similar to calculate_c_matrix_np in simulation_umts24.py
-def calculate_c_matrix_np(c):
-	"""
-	Adapted from: https://github.com/KatinkaBou/Probabilistic-Bounds-On-Singular-Values-Of-Rotation-Matrices/blob/c92bfa863fc640ca0c39b321dde1696edf84d467/negacyclic_probabilistic_bound.py#L20
-	turn the polynomial into matrix form by using a rotation matrix
-	"""
-	row = np.zeros(c.shape[0], dtype=int)
-	row[0] = c[0]
-	row[1:] = -c[-1:0:-1]
-
-	c_matrix = toeplitz(c, row)
-	return c_matrix
+# Store signature data with compact challenges (signed positions, see compress_challenges)
+# in the directory 'out_path'. load_data reads the result like the data generator output.
+# Without challenges, an empty store is written.
+def save_compact(out_path, s1, y, z, c, bs, poly, coeff, block_size=100_000):
+    os.makedirs(out_path, exist_ok=True)
+    blocks = [compress_challenges(c[i:i + block_size]) for i in range(0, len(c), block_size)]
+    compact = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.int16)
+    for name, data in [('s1', s1), ('y', y), ('z', z), ('c', compact), ('poly', poly), ('coeff', coeff)]:
+        np.save(os.path.join(out_path, name + '.npy'), data)
+    if len(bs):
+        np.save(os.path.join(out_path, 'bs.npy'), bs)
 
 # Cauchy regression similar to regression.py
-def cauchy(A, b, beta, iterations=30, convergence_eps=0.01, convergence_min_run = 10):
+def cauchy(A, b, beta, iterations=30, convergence_eps=0.01, convergence_min_run = 10, beta_init=None, verbose=True):
 	'''Solve by Cauchy estimator
 	solves an iterative reweighted least squares regression with the following parameters.
 	estimates a key and rounds it to the nearest integer. Then compares if actually matches and stops if so.
@@ -51,20 +56,26 @@ def cauchy(A, b, beta, iterations=30, convergence_eps=0.01, convergence_min_run
 	iterations: stops after those iterations if it did not converge to the correct solution
 	convergence_eps: Maximum change in prediction in max norm until convergence counter starts
 	convergence_min_run: How long does convergence needs to get stuck before we break
+	beta_init: previous estimate to warm start from, the first weights are computed from its residuals
+	verbose: show a progress bar
 
 	returns
 	beta_est: estimated regressor (estimated key for dilithium)
 	t: how many iterations have past?
 	'''
+	from sklearn.linear_model import LinearRegression
 	lr = LinearRegression(n_jobs=1)
 	convergence_counter = 0
 	n=len(b)
 
 	weights = np.ones(n) / n
+	if beta_init is not None:
+		weights = 1 / (1 + (b - A @ beta_init)**2)
+		weights /= np.sum(weights)
 
-	last_estimate = np.zeros_like(beta)
+	last_estimate = np.zeros_like(beta) if beta_init is None else beta_init
 
-	for t in tqdm(range(iterations)):
+	for t in (tqdm(range(iterations)) if verbose else range(iterations)):
 		# Fit Least Squares (weighted)
 		lr.fit(A, b, sample_weight=weights)
 		beta_est = lr.coef_
@@ -87,51 +98,163 @@ def cauchy(A, b, beta, iterations=30, convergence_eps=0.01, convergence_min_run
 
 		if correct_predictions==256 or convergence_counter >= convergence_min_run:
 			break
+	METRICS.inc('irls_iterations', t + 1, loss='cauchy')
 	return beta_est, t
 
+# Online key recovery from classifier predictions that arrive in batches, e.g. while attack
+# traces are captured (see capture_attack_online in capture.py).
+# Equations predicted as y>=0 are appended per polynomial with compact challenges. Every
+# 'refit_every' batches each polynomial with at least N equations is re-estimated by cauchy,
+# warm-started from its previous estimate, if it gained a factor 'growth' of equations since
+# its last refit. Refits are thus spaced geometrically and all refits together cost a constant
+# factor (about growth / (growth - 1)) of the last one, instead of growing quadratically with
+# the number of batches. A coefficient is stable if its rounded estimate did not change in the
+# last 'stable_runs' refits, the recovery is done once all L*N coefficients are stable. If the
+# key 's1' is given, the correct coefficients are reported.
+class OnlineRecovery:
+    def __init__(self, c, coeff, poly, z, L, N, s1=None, refit_every=1, stable_runs=3, iterations=30, growth=1.25, verbose=True):
+        self.c, self.coeff, self.poly, self.z = c, coeff, poly, z
+        self.L, self.N = L, N
+        self.compact = c.shape[1] != N
+        self.s1 = s1
+        self.refit_every = refit_every
+        self.stable_runs = stable_runs
+        self.iterations = iterations
+        self.growth = growth
+        self.verbose = verbose
+
+        self.eq_c = [[] for _ in range(L)]
+        self.eq_coeff = [[] for _ in range(L)]
+        self.eq_z = [[] for _ in range(L)]
+        self.eq_n = np.zeros(L, dtype=int)
+        self.refit_n = np.zeros(L, dtype=int)  # equations at the last refit
+        self.estimates = np.zeros((L, N))
+        self.fitted = np.zeros(L, dtype=bool)
+        self.stable = np.zeros((L, N), dtype=int)
+        self.consumed = 0
+        self.batches = 0
+        self.t0 = time.time()
+
+    # Append the equations start, ..., start + len(predictions) - 1 with prediction 1.
+    # Returns True once the recovery is done, i.e. capturing can stop.
+    def add_batch(self, start, predictions):
+        idx = start + np.flatnonzero(np.asarray(predictions).astype(int) == 1)
+        poly = self.poly[idx]
+        for l in range(self.L):
+            sel = idx[poly == l]
+            if len(sel) == 0:
+                continue
+            c = np.asarray(self.c[sel])
+            self.eq_c[l].append(c if self.compact else compress_challenges(c))
+            self.eq_coeff[l].append(self.coeff[sel])
+            self.eq_z[l].append(self.z[sel])
+            self.eq_n[l] += len(sel)
+        METRICS.inc('traces', max(0, start + len(predictions) - self.consumed))
+        METRICS.inc('equations', len(idx))
+        self.consumed = max(self.consumed, start + len(predictions))
+        self.batches += 1
+        if self.batches % self.refit_every == 0:
+            self.refit()
+        return self.done()
+
+    # Re-estimate every polynomial with enough new equations (all with new equations if 'force')
+    # and update the stability counters.
+    def refit(self, force=False):
+        for l in range(self.L):
+            if self.eq_n[l] < self.N or self.eq_n[l] == self.refit_n[l]:
+                continue
+            if not force and self.eq_n[l] < self.growth * self.refit_n[l]:
+                continue
+            for eq in (self.eq_c, self.eq_coeff, self.eq_z):
+                eq[l] = [np.concatenate(eq[l])]
+            self.refit_n[l] = self.eq_n[l]
+            C = expand_dense(self.eq_c[l][0], self.eq_coeff[l][0], self.N)
+            s = self.s1[l] if self.s1 is not None else np.zeros(self.N)
+            beta_init = self.estimates[l] if self.fitted[l] else None
+            with METRICS.timer('refit_seconds', poly=l):
+                estimate = cauchy(C, self.eq_z[l][0], s, iterations=self.iterations, beta_init=beta_init, verbose=False)[0]
+            unchanged = self.fitted[l] & (np.round(estimate) == np.round(self.estimates[l]))
+            self.stable[l] = np.where(unchanged, self.stable[l] + 1, 0)
+            self.estimates[l] = estimate
+            self.fitted[l] = True
+        METRICS.set('stable_coefficients', self.stable_coefficients())
+        if self.s1 is not None:
+            METRICS.set('correct_coefficients', self.correct_coefficients())
+        if self.verbose:
+            report = f"{self.consumed} traces, {self.eq_n.sum()} equations, {self.stable_coefficients()}/{self.L * self.N} stable coefficients"
+            if self.s1 is not None:
+                report += f", {self.correct_coefficients()}/{self.L * self.N} correct"
+            print(report + f" ({time.time() - self.t0:.1f}s)")
+
+    def stable_coefficients(self):
+        return int(np.sum(self.fitted.reshape(-1, 1) & (self.stable >= self.stable_runs)))
+
+    def correct_coefficients(self):
+        return int(np.sum(self.fitted.reshape(-1, 1) & (np.round(self.estimates) == self.s1)))
+
+    def done(self):
+        return self.stable_coefficients() == self.L * self.N
+
+    # Estimated key, rounded to integers
+    def key(self):
+        return np.round(self.estimates).astype(int)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Usage:  <data directory> <prediction.npy>")
     parser.add_argument("directory")
     parser.add_argument("file_name")
+    parser.add_argument("--compact", type=str, default=None, help="also write the data with compact challenges to this directory")
+    parser.add_argument("--online", action="store_true", help="consume the predictions in batches and stop once the key estimate is stable, see OnlineRecovery")
+    parser.add_argument("--batch-size", type=int, default=10000, help="predictions per batch in online mode")
+    parser.add_argument("--refit-every", type=int, default=1, help="batches between re-estimations in online mode")
+    parser.add_argument("--stable-runs", type=int, default=3, help="re-estimations without change until a coefficient is stable in online mode")
+    parser.add_argument("--growth", type=float, default=1.25, help="factor of new equations of a polynomial until it is re-estimated in online mode")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve live metrics (Prometheus text) on this port, see metrics.py")
+    parser.add_argument("--metrics-file", type=str, default=None, help="write live metrics as JSON to this file every few seconds")
 
     # Parse command line arguments
     args = parser.parse_args()
+    METRICS.start(port=args.metrics_port, path=args.metrics_file)
     # Load attak_data
     s1, y, z, c, bs, poly, coeff = load_data(args.directory + "/")
+    if args.compact is not None:
+        save_compact(args.compact, s1, y, z, c, bs, poly, coeff)
     # Load predition file
     prediction = np.load(args.file_name, allow_pickle=True)
 
-    # Maximum equations per polynomial
-    n = len(prediction)
     # We need equations per polynomial!
     L, N = s1.shape
-    eq_n = np.zeros((L), dtype=int)
-    eq_z = np.zeros((L, n))
-    eq_c = np.zeros((L, n, N))
-    
-    # Build ILWE instanes from attack data
+    compact = c.shape[1] != N
+
+    if args.online:
+        recovery = OnlineRecovery(c, coeff, poly, z, L, N, s1=s1, refit_every=args.refit_every, stable_runs=args.stable_runs, growth=args.growth)
+        for start in range(0, len(prediction), args.batch_size):
+            if recovery.add_batch(start, prediction[start:start + args.batch_size]):
+                break
+        else:
+            recovery.refit(force=True)
+        print(f"Used {recovery.consumed} of {len(prediction)} traces ({recovery.consumed / len(prediction) * 100:.2f}%)")
+        print(f"Correct coefficients: {recovery.correct_coefficients()} of {L * N}")
+        sys.exit()
+
+    # Build ILWE instanes from attack data, store challenges compact and expand rows of C per polynomial
     print(f"Collecting problem data:")
-    positive = 0
-    zeroError = 0
-    zeroKnowledge = 0
-    for i in tqdm(range(n)):
-        if prediction[i] == 1:
-            l = poly[i]
-            n = coeff[i]
-            polyIdx = eq_n[l]
-
-            eq_z[l][polyIdx] = z[i]
-            eq_c[l][polyIdx] = calculate_c_matrix_np(c[i])[n]
-
-            if y[i] == 0:
-                zeroError += 1
-            if y[i] < 0:
-                zeroKnowledge += 1
-
-            eq_n[l] += 1
-            positive += 1
+    selected = np.asarray(prediction).astype(int) == 1
+    eq_n = np.zeros((L), dtype=int)
+    eq_z = []
+    eq_c = []
+    eq_coeff = []
+    for l in tqdm(range(L)):
+        idx = np.flatnonzero(selected & (poly == l))
+        eq_n[l] = len(idx)
+        eq_z.append(z[idx])
+        eq_c.append(np.asarray(c[idx]) if compact else compress_challenges(c[idx]))
+        eq_coeff.append(coeff[idx])
     print()
 
+    positive = int(np.count_nonzero(selected))
+    zeroError = int(np.count_nonzero(y[selected] == 0))
+    zeroKnowledge = int(np.count_nonzero(y[selected] < 0))
     independentError = positive - zeroError - zeroKnowledge
     negative = len(prediction) - positive
 
@@ -146,11 +269,13 @@ if __name__ == "__main__":
     print()
 
     # Recover secret key!
+    METRICS.progress('polynomials', 0, L)
     for i in range(L):
         print(f"Computing secret key polynomial {i}:")
-        z = eq_z[i][:eq_n[i]]
-        Cm = eq_c[i][:eq_n[i]]
+        Cm = expand_dense(eq_c[i], eq_coeff[i], N)
         s = s1[i]
-        res = cauchy(Cm, z, s, iterations=100)
+        with METRICS.timer('solve_seconds', poly=i):
+            res = cauchy(Cm, eq_z[i], s, iterations=100)
+        METRICS.progress('polynomials', i + 1, L)
         print(f"Correct coefficients: " + str(np.sum(s == np.round(res[0]))) + f" ({res[1]} iterations)")
         print()
@@ -2,7 +2,8 @@
 Wrapper to use regression on Concealed Integer Learning with Errors.
 """
 import argparse
-from regression import ILWE, run_all
+from regression import ILWE, run_all, TIMEOUT
+from portfolio import race
 
 parser = argparse.ArgumentParser('sample solver for CILWE for Dilithium')
 parser.add_argument('--n', type = int, default = 256, help = 'dimension of the secret key')
@@ -12,6 +13,9 @@ parser.add_argument('--p', type = float, default = 0.1, help = 'contamination ra
 parser.add_argument('--eta', type = int, default = 2, help = 'key coefficients between -eta and +eta')
 parser.add_argument('--seed', type = int, default = 0, help = 'key coefficients between -eta and +eta')
 parser.add_argument('--full', action = 'store_true', default = False, help = 'run large scale experiment and plot results')
+parser.add_argument('--race', nargs = '*', default = None, help = 'race the given methods (default: all) in parallel processes and stop at the first correct key')
+parser.add_argument('--timeout', type = float, default = TIMEOUT, help = 'wall-clock timeout of --race in seconds')
+parser.add_argument('--record_all', action = 'store_true', default = False, help = 'with --race, let all methods finish until the timeout')
 
 args = parser.parse_args()
 print(args)
@@ -19,12 +23,20 @@ print(args)
 if args.full:
 	run_all()
 	input()
+elif args.race is not None:
+	instance = ILWE(args.m, args.p, args.n, eta = args.eta, tau = args.tau, seed = args.seed)
+	method, _ = race(instance, args.race or list(instance.methods.keys()), args.timeout, record_all = args.record_all)
+	print(f'first correct key: {method}')
+	print(instance)
+	print(instance.log)
 else:
 	instance = ILWE(args.m, args.p, args.n, eta = args.eta, tau = args.tau, seed = args.seed)
 	instance.cauchy()
+	instance.cauchy_pp()
 	instance.L1()
 	instance.L2()
 	instance.huber()
 	instance.ILP()
+	instance.ILP_hint()
 	print(instance)
 	print(instance.log)
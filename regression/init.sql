@@ -23,28 +23,59 @@ method(
 	name string
 );
 
+-- success counts per cell, maintained by run_method in the same transaction as the run insert (see ensure_summary in regression.py)
+create table if not exists 
+summary(
+	method_id integer references method(rowid),
+	p float,
+	eta integer,
+	tau integer,
+	m integer,
+	total integer, -- number of runs
+	solved integer, -- number of solved runs
+	primary key (method_id, p, eta, tau, m)
+);
+
+-- number of instances per cell, maintained together with every instance insert (see ensure_summary in regression.py)
+create table if not exists 
+cell(
+	p float,
+	eta integer,
+	tau integer,
+	m integer,
+	instances integer,
+	primary key (p, eta, tau, m)
+);
+
 insert into method (name) values ('ILP');
 insert into method (name) values ('L1');
 insert into method (name) values ('huber');
 insert into method (name) values ('cauchy');
 insert into method (name) values ('L2');
+insert into method (name) values ('cauchy_pp');
+insert into method (name) values ('ILP_hint');
 
+-- views of the runs per method (joined by name), ensure_summary in regression.py recreates them in existing databases
 create view compare as 
 select instance.rowid as id,m,n,eta,tau,p,seed, errors,
-	printf("%.3f", time_ILP)    as t_ILP,    r1.s as s1, 
-	printf("%.3f", time_L1)     as t_L1,     r2.s as s2,
-	printf("%.3f", time_huber)  as t_huber,  r3.s as s3,
-	printf("%.3f", time_cauchy) as t_cauchy, r4.s as s4,
-	printf("%.3f", time_L2)     as t_L2,     r5.s as s5
+	printf("%.3f", time_ILP)       as t_ILP,       r1.s as s1,
+	printf("%.3f", time_L1)        as t_L1,        r2.s as s2,
+	printf("%.3f", time_huber)     as t_huber,     r3.s as s3,
+	printf("%.3f", time_cauchy)    as t_cauchy,    r4.s as s4,
+	printf("%.3f", time_L2)        as t_L2,        r5.s as s5,
+	printf("%.3f", time_cauchy_pp) as t_cauchy_pp, r6.s as s6,
+	printf("%.3f", time_ILP_hint)  as t_ILP_hint,  r7.s as s7
 from instance 
-left join (select instance_id,time as time_ILP,    solved as s from run where method_id = 1) r1 on instance.rowid = r1.instance_id 
-left join (select instance_id,time as time_L1,     solved as s from run where method_id = 2) r2 on instance.rowid = r2.instance_id
-left join (select instance_id,time as time_huber,  solved as s from run where method_id = 3) r3 on instance.rowid = r3.instance_id
-left join (select instance_id,time as time_cauchy, solved as s from run where method_id = 4) r4 on instance.rowid = r4.instance_id
-left join (select instance_id,time as time_L2,     solved as s from run where method_id = 5) r5 on instance.rowid = r5.instance_id;
+left join (select instance_id,time as time_ILP,       solved as s from run join method on method_id = method.rowid where method.name = 'ILP') r1 on instance.rowid = r1.instance_id
+left join (select instance_id,time as time_L1,        solved as s from run join method on method_id = method.rowid where method.name = 'L1') r2 on instance.rowid = r2.instance_id
+left join (select instance_id,time as time_huber,     solved as s from run join method on method_id = method.rowid where method.name = 'huber') r3 on instance.rowid = r3.instance_id
+left join (select instance_id,time as time_cauchy,    solved as s from run join method on method_id = method.rowid where method.name = 'cauchy') r4 on instance.rowid = r4.instance_id
+left join (select instance_id,time as time_L2,        solved as s from run join method on method_id = method.rowid where method.name = 'L2') r5 on instance.rowid = r5.instance_id
+left join (select instance_id,time as time_cauchy_pp, solved as s from run join method on method_id = method.rowid where method.name = 'cauchy_pp') r6 on instance.rowid = r6.instance_id
+left join (select instance_id,time as time_ILP_hint,  solved as s from run join method on method_id = method.rowid where method.name = 'ILP_hint') r7 on instance.rowid = r7.instance_id;
 
 create view success_count as 
-select n,m,p,sum(s1) ILP, sum(s2) L1,sum(s3) huber,sum(s4) cauchy,sum(s5) L2 from compare group by n,m,p order by p,m;
+select n,m,p,sum(s1) ILP, sum(s2) L1,sum(s3) huber,sum(s4) cauchy,sum(s5) L2,sum(s6) cauchy_pp,sum(s7) ILP_hint from compare group by n,m,p order by p,m;
 
 create view success_chance as
 select r1.m as m, r1.errors as errors, success, total, printf("%.3f", 1.0*success/total) as chance from (select errors,m, count(*) success from compare where errors < 100 and s2 = 1 group by errors,m) as r1, (select errors,m, count(*) total from compare where errors < 100 group by errors,m) as r2 where r1.errors = r2.errors and r1.m = r2.m order by m, errors;
@@ -1,35 +1,64 @@
-import matplotlib.pyplot as plt
 import sqlite3
+from matplotlib.figure import Figure
 
 NIST_PARAMS = {2: (2,39), 3: (4,49), 5:(2,60)}
+# method name -> (line style, label)
+STYLES = {
+	'ILP': ('o-', 'ILP'),
+	'L1': ('d-', 'L1'),
+	'huber': ('v-', 'Huber'),
+	'cauchy': ('s-', 'Cauchy'),
+	'L2': ('^-', 'L2'),
+	'cauchy_pp': ('x-', 'Cauchy + post-processing'),
+	'ILP_hint': ('*-', 'ILP + hints'),
+}
+# level -> (figure, axes, method -> line, method -> plotted series), kept between calls to only redraw changed series
+FIGURES = {}
 
-def plot(level):
+def min_measurements(level, database = 'data/runs.db', threshold = 0.95):
+	"""smallest m with success rate >= threshold per method and contamination rate, read from the summary and cell tables
+
+	the success rate is solved runs / instances of (m, p) as in the compare view, so a method that has not run on all instances of a cell
+	counts the missing runs as failures. returns contaminations (sorted) and method -> list of m (None if there is no such m) for these contaminations
+	"""
 	eta, tau = NIST_PARAMS[level]
-	database = 'data/runs.db'
 	conn = sqlite3.connect(database)
 	cursor = conn.cursor()
-	cursor.execute('select m,p, count(*), sum(s1) as ILP ,sum(s2) as L1,sum(s3) as huber,sum(s4) as cauchy, sum(s5) as L2 from compare where eta = ? and tau = ? group by m,p order by p, m;', (eta, tau))
+	cursor.execute('select name, p, m, solved from summary join method on method_id = method.rowid where eta = ? and tau = ?;', (eta, tau))
 	data = cursor.fetchall()
+	cursor.execute('select p, m, instances from cell where eta = ? and tau = ?;', (eta, tau))
+	instances = {(p, m): count for p, m, count in cursor.fetchall()}
 	conn.close()
-	contaminations = list(set(row[1] for row in data))
-	contaminations.sort()
+	contaminations = sorted(set(row[1] for row in data))
+	best = {}
+	for name, p, m, solved in data:
+		if solved/instances[(p, m)] >= threshold and m < best.get((name, p), float('inf')):
+			best[(name, p)] = m
+	return contaminations, {name: [best.get((name, p)) for p in contaminations] for name in STYLES}
+
+def plot(level):
+	contaminations, min_m = min_measurements(level)
+	if level not in FIGURES:
+		fig = Figure(figsize=(5.5, 4))
+		ax = fig.add_subplot()
+		ax.set_yscale('log', base = 2)
+		ax.set_xticks([x/10 for x in range(10)])
+		ax.set_xlabel('concealment rate')
+		ax.set_ylabel('no. of measurements')
+		ax.set_title(f'Measurements for NIST Level {level}')
+		lines = {name: ax.plot([], [], style, label = label)[0] for name, (style, label) in STYLES.items()}
+		ax.legend()
+		FIGURES[level] = (fig, ax, lines, {})
+	fig, ax, lines, plotted = FIGURES[level]
 
-	min_m_ILP = [min((row[0] for row in data if row[3] is not None and row[3]/row[2] >= 0.95 and row[1] == p), default = None) for p in contaminations]
-	min_m_L1  = [min((row[0] for row in data if row[4] is not None and row[4]/row[2] >= 0.95 and row[1] == p), default = None) for p in contaminations]
-	min_m_hub = [min((row[0] for row in data if row[5] is not None and row[5]/row[2] >= 0.95 and row[1] == p), default = None) for p in contaminations]
-	min_m_cau = [min((row[0] for row in data if row[6] is not None and row[6]/row[2] >= 0.95 and row[1] == p), default = None) for p in contaminations]
-	min_m_L2  = [min((row[0] for row in data if row[7] is not None and row[7]/row[2] >= 0.95 and row[1] == p), default = None) for p in contaminations]
-	plt.figure(figsize=(5.5, 4))
-	plt.yscale('log', base = 2)
-	plt.xticks([x/10 for x in range(10)])
-	plt.plot(contaminations, min_m_ILP, 'o-', label = 'ILP')
-	plt.plot(contaminations, min_m_L1 , 'd-', label = 'L1')
-	plt.plot(contaminations, min_m_hub, 'v-', label = 'Huber')
-	plt.plot(contaminations, min_m_cau, 's-', label = 'Cauchy')
-	plt.plot(contaminations, min_m_L2 , '^-', label = 'L2')
-	plt.xlabel('concealment rate')
-	plt.ylabel('no. of measurements')
-	plt.legend()
-	plt.title(f'Measurements for NIST Level {level}')
-	plt.savefig(f'data/NIST{level}.pdf')
-	plt.close()
+	changed = False
+	for name, series in min_m.items():
+		series = (tuple(contaminations), tuple(series))
+		if plotted.get(name) == series: continue
+		lines[name].set_data(series[0], [float('nan') if m is None else m for m in series[1]])
+		plotted[name] = series
+		changed = True
+	if not changed: return
+	ax.relim()
+	ax.autoscale_view()
+	fig.savefig(f'data/NIST{level}.pdf')
@@ -0,0 +1,92 @@
+"""
+Portfolio of regression methods racing on the same CILWE instance in parallel processes
+"""
+import copy
+import time
+import queue
+import multiprocessing as mp
+import numpy as np
+
+from shared import SharedArrays, attach
+
+# arrays of ILWE instances sent to the workers via shared memory instead of pickling
+SHARED_ATTRIBUTES = ('C', 'z', 'e', 's')
+
+def verify_key(instance):
+	"""verifier for instances with known key (experiments)"""
+	return lambda s: s is not None and bool((s == instance.s).all())
+
+def verify_inliers(C, z, min_inliers):
+	"""verifier without known key: inliers of CILWE are fulfilled exactly, so a key is accepted if at least min_inliers equations are fulfilled exactly"""
+	return lambda s: s is not None and np.count_nonzero(z - C @ s == 0) >= min_inliers
+
+def _worker(instance, handles, method, results):
+	"""attach the arrays of instance, run one method and report (method, solution data, log) to the parent"""
+	with attach(handles) as arrays:
+		for name, array in arrays.items():
+			setattr(instance, name, array)
+		getattr(instance, method)()
+		results.put((method, instance.solutions[method], instance.log))
+		for name in arrays:
+			setattr(instance, name, None)
+
+def race(instance, methods, timeout, verify = None, record_all = False, start_method = 'fork', backend = 'shm'):
+	"""Run methods on instance in parallel processes
+
+	returns as soon as one method returns a key accepted by verify (default: verify_key(instance)) and terminates all other workers.
+	The wall-clock timeout is enforced by terminating the workers, independent of the solver options.
+	With record_all, all workers may finish until the timeout (experiments), instead of stopping at the first verified key.
+	C, z, e and s are shared with the workers via SharedArrays (backend 'shm' or 'mmap'), so only the small rest of the instance is sent
+	to the workers, also with start_method 'spawn' or 'forkserver'.
+
+	the solution data of all finished methods is stored in instance.solutions, their logs are appended to instance.log
+
+	returns
+	method: name of the first method with a verified key, None if there is none
+	s: verified key or None
+	"""
+	verify = verify_key(instance) if verify is None else verify
+	ctx = mp.get_context(start_method)
+	results = ctx.Queue()
+	log_start = len(instance.log)
+	shared = SharedArrays({name: getattr(instance, name) for name in SHARED_ATTRIBUTES}, backend = backend)
+	light = copy.copy(instance)
+	for name in SHARED_ATTRIBUTES:
+		setattr(light, name, None)
+	light.methods = {}
+	light.solutions = {}
+	workers = {method: ctx.Process(target = _worker, args = (light, shared.handles, method, results), daemon = True) for method in methods}
+	for worker in workers.values():
+		worker.start()
+
+	deadline = time.time() + timeout
+	winner, key = None, None
+	pending = set(methods)
+	while pending:
+		remaining = deadline - time.time()
+		if remaining <= 0: break
+		try:
+			method, solution, log = results.get(timeout = min(remaining, 1))
+		except queue.Empty:
+			# a worker may have died without reporting
+			pending = {m for m in pending if workers[m].is_alive() or not results.empty()}
+			continue
+		pending.discard(method)
+		instance.solutions[method] = solution
+		instance.log += log[log_start:]
+		if winner is None and verify(solution[3]):
+			winner, key = method, solution[3]
+			if not record_all: break
+
+	for method in pending:
+		instance.log.append((time.time(), f'{method} cancelled'))
+	for worker in workers.values():
+		if worker.is_alive():
+			worker.terminate()
+	for worker in workers.values():
+		worker.join(1)
+		if worker.is_alive():
+			worker.kill()
+			worker.join()
+	shared.close()
+	return winner, key
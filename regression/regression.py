@@ -5,16 +5,14 @@ import os
 import time
 import warnings
 import sqlite3
+import importlib.util
 import numpy as np
-import cvxpy as cvx
-import mosek
-from tabulate import tabulate
-from sklearn.linear_model import LinearRegression
 
+# cvxpy, sklearn, tabulate and plot (matplotlib) are imported by the methods that use them, mosek only by cvxpy if it is used
 from sampler import generate_sample
-from plot import plot
+from metrics import METRICS
 warnings.filterwarnings("ignore")
-MOSEK_FLAG = os.path.isfile('~/mosek/mosek.lic')
+MOSEK_FLAG = os.path.isfile('~/mosek/mosek.lic') and importlib.util.find_spec('mosek') is not None
 
 # PARAMS
 VERBOSE = False
@@ -22,7 +20,14 @@ TIMEOUT = 120
 ATTEMPTS = 100
 SUCCESS_THRESHOLD = 0.95
 HUBER_PARAM = 0.125
+PP_COEFFICIENTS = 12 # least confident coefficients tried in both roundings by cauchy_pp (2^PP_COEFFICIENTS candidates)
+ILP_FIX_CONFIDENCE = 2.0 # ILP_hint fixes coefficients at least this many standard deviations away from the rounding boundary
+COMPACT = False # store C as int8 and z, e as int16, and run the IRLS iterations in float32 with a final float64 step (see ILWE.float64 and _cauchy_irls)
 NIST_LEVEL = 2 # must be 2,3 or 5
+METRICS_PORT = 8000 # live metrics (Prometheus text) of run_all on http://localhost:8000/metrics, None to disable, see metrics.py
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1') # docker-compose.yml sets 0.0.0.0 in the container and publishes the port on localhost only
+METRICS_FILE = 'data/metrics.json' # live metrics as JSON, None to disable
+CONTAMINATIONS = [0.01,0.05,0.1,0.15,0.2,0.25,0.3,0.35,0.4,0.45,0.5,0.55,0.6,0.65,0.7,0.75,0.8,0.85,0.9]
 
 # parameters given by the setting of ML-DSA
 NIST_PARAMS = {2: (2,39), 3: (4,49), 5: (2,60)}
@@ -57,13 +62,14 @@ class ILWE():
 			return s,t,solved
 		return inner
 
-	def __init__(self, m, p, n = DIMENSION, eta = ETA, tau = TAU, seed = None):
+	def __init__(self, m, p, n = DIMENSION, eta = ETA, tau = TAU, seed = None, compact = None):
 		"""Create instance for CILWE
 
 		Input:
 			m: number of equations
 			n: dimension
 			seed: for PRNG, to create instance
+			compact: store C as int8 and z, e as int16 (default COMPACT), the instance is the same for a given seed
 		Output: instance, whose attributes satisfy z = C @ s + e
 			z: public vector
 			C: matrix
@@ -72,31 +78,36 @@ class ILWE():
 		"""
 		self.m = m
 		self.n = n
+		self.compact = COMPACT if compact is None else compact
 		self.eta = eta
 		self.tau = tau
 		self.log = []
 		self.solutions = {} # dictionary method-name -> solution data
 		self.methods = {
 				'ILP': self.ILP, # comment out ILP to speed up the overall process
+				'ILP_hint': self.ILP_hint,
 				'L1': self.L1,
 				'L2': self.L2,
 				'huber': self.huber,
-				'cauchy': self.cauchy
+				'cauchy': self.cauchy,
+				'cauchy_pp': self.cauchy_pp
 			}
 
 		if seed is not None:
 			np.random.seed(seed)
-		self.C, self.z, self.e, self.s = generate_sample(m, tau, p, dim = n, eta = eta, filterthresh = tau)
+		self.C, self.z, self.e, self.s = generate_sample(m, tau, p, dim = n, eta = eta, filterthresh = tau, compact = self.compact)
 		self.k = int((self.e != 0).sum()) # number of errors
 
 	@timer
 	def L1(self):
 		"""Solve convex problem to minimise 1-norm, is actually an LP"""
+		import cvxpy as cvx
+		C, z = self.float64()
 		s = cvx.Variable(self.n)
 		e = cvx.Variable(self.m)
-		prob = cvx.Problem(cvx.Minimize(cvx.norm(e,1)), [-self.eta <= s, s <= self.eta, self.C @ s == self.z - e])
+		prob = cvx.Problem(cvx.Minimize(cvx.norm(e,1)), [-self.eta <= s, s <= self.eta, C @ s == z - e])
 		if MOSEK_FLAG:
-			prob.solve(solver = cvx.MOSEK, mosek_params={mosek.dparam.optimizer_max_time: TIMEOUT}, verbose = VERBOSE)
+			prob.solve(solver = cvx.MOSEK, mosek_params={'MSK_DPAR_OPTIMIZER_MAX_TIME': TIMEOUT}, verbose = VERBOSE)
 		else:
 			prob.solve(solver = cvx.SCIPY, scipy_options = {'disp':VERBOSE, 'time_limit':TIMEOUT})
 		return np.array(s.value.round(), dtype = np.int64)
@@ -104,17 +115,20 @@ class ILWE():
 	@timer
 	def L2(self):
 		"""Solve via least-squares"""
-		s = np.dot((np.dot(np.linalg.inv(np.dot(self.C.T, self.C)), self.C.T)), self.z)
+		C, z = self.float64()
+		s = np.dot((np.dot(np.linalg.inv(np.dot(C.T, C)), C.T)), z)
 		return np.array(s.round(), dtype = np.int64)
 
 	@timer
 	def huber(self):
 		"""Solve convex problem to minimise Huber loss"""
+		import cvxpy as cvx
+		C, z = self.float64()
 		s = cvx.Variable(self.n)
 		e = cvx.Variable(self.m)
-		prob = cvx.Problem(cvx.Minimize(cvx.sum(cvx.huber(e,M = HUBER_PARAM))), [-self.eta <= s, s <= self.eta, self.C @ s == self.z - e])
+		prob = cvx.Problem(cvx.Minimize(cvx.sum(cvx.huber(e,M = HUBER_PARAM))), [-self.eta <= s, s <= self.eta, C @ s == z - e])
 		if MOSEK_FLAG:
-			prob.solve(solver = cvx.MOSEK, mosek_params={mosek.dparam.optimizer_max_time: TIMEOUT}, verbose = VERBOSE)
+			prob.solve(solver = cvx.MOSEK, mosek_params={'MSK_DPAR_OPTIMIZER_MAX_TIME': TIMEOUT}, verbose = VERBOSE)
 		else:
 			prob.solve(solver = cvx.CLARABEL, time_limit = TIMEOUT, verbose = VERBOSE)
 		return np.array(s.value.round(), dtype = np.int64)
@@ -135,15 +149,36 @@ class ILWE():
 		returns
 		beta_est: estimated regressor (estimated key for dilithium)
 		"""
+		beta_est, _ = self._cauchy_irls()
+		return np.array(beta_est.round(), dtype = np.int64)
+
+	@timer
+	def cauchy_pp(self):
+		"""Solve by Cauchy estimator with confidence-guided post-processing
+		runs the Cauchy estimator and, instead of only rounding the estimate, tries both roundings of the PP_COEFFICIENTS least confident coefficients
+		and corrects single coefficients while this fulfills more equations exactly, see correct_least_confident.
+
+		returns
+		beta_est: estimated regressor (estimated key for dilithium)
+		"""
+		beta_est, weights = self._cauchy_irls()
+		return correct_least_confident(self.C, self.z, beta_est, weights, PP_COEFFICIENTS, self.eta)
+
+	def _cauchy_irls(self, timeout = None):
+		"""iterations of the Cauchy estimator, see cauchy. stops after timeout (default TIMEOUT) seconds. returns the real valued estimate and the final weights"""
+		timeout = TIMEOUT if timeout is None else timeout
+		from sklearn.linear_model import LinearRegression
 		lr = LinearRegression(n_jobs=1)
 		convergence_counter = 0
 		start = time.time()
-		A = self.C
-		b = self.z
+		# compact: float32 iterations, sklearn keeps the dtype of A
+		dtype = np.float32 if self.compact else np.float64
+		A = self.C.astype(dtype, copy = False)
+		b = self.z.astype(dtype, copy = False)
 		n = len(b)
 		beta = self.s
 
-		weights = np.ones(n) / n
+		weights = np.ones(n, dtype = dtype) / n
 
 		last_estimate = np.zeros_like(beta)
 		iterations = 1<<32 # limit is given via convergence and timeout
@@ -152,6 +187,7 @@ class ILWE():
 
 		for t in range(iterations):
 			# Fit Least Squares (weighted)
+			fit_weights = weights
 			lr.fit(A, b, sample_weight=weights)
 			beta_est = lr.coef_
 
@@ -172,9 +208,31 @@ class ILWE():
 				convergence_counter = 0
 
 			if correct_predictions==256 or convergence_counter >= convergence_min_run: break
-			if time.time() - start >= TIMEOUT: break
+			if time.time() - start >= timeout: break
 		self.log.append((time.time(), f'Cauchy: {t} iterations'))
-		return np.array(beta_est.round(), dtype = np.int64)
+		if self.compact:
+			beta_est, weights = self._refine_float64(beta_est, fit_weights)
+		return beta_est, weights
+
+	def _refine_float64(self, beta_est, weights):
+		"""repeat the last iteration of the float32 IRLS of _cauchy_irls (compact) in float64
+
+		solves the weighted least squares problem with the weights of the last iteration in float64 and logs how many rounded coefficients differ from the float32 estimate.
+		returns the float64 estimate and the weights of its residuals
+		"""
+		from sklearn.linear_model import LinearRegression
+		C, z = self.float64()
+		beta_64 = LinearRegression(n_jobs=1).fit(C, z, sample_weight = weights.astype(np.float64)).coef_
+		mismatch = np.count_nonzero(np.round(beta_est) != np.round(beta_64))
+		if mismatch:
+			self.log.append((time.time(), f'Cauchy: float32 estimate differs from float64 in {mismatch} rounded coefficients'))
+		residuals = z - C @ beta_64
+		weights = 1 / (1 + residuals**2)
+		return beta_64, weights / np.sum(weights)
+
+	def float64(self):
+		"""C and z as float64 (without copy, if they are not compact) for solvers that need floating point input"""
+		return self.C.astype(np.float64, copy = False), self.z.astype(np.float64, copy = False)
 
 	@timer
 	def ILP(self):
@@ -185,39 +243,221 @@ class ILWE():
 		Output:
 			s|None: solution vector
 		"""
+		import cvxpy as cvx
+		C, z = self.float64()
 		e = cvx.Variable(self.m, boolean = True)
 		s = cvx.Variable(self.n, integer = True)
-		constraints = [s >= - self.eta, s <= self.eta, self.z - self.C @ s <= K * (1-e), self.z - self.C @ s >= -K * (1-e)]
+		constraints = [s >= - self.eta, s <= self.eta, z - C @ s <= self.n * self.eta * (1-e), z - C @ s >= -self.n * self.eta * (1-e)]
 		objective = cvx.Maximize(cvx.sum(e))
 		prob = cvx.Problem(objective, constraints)
 		try:
 			if MOSEK_FLAG:
-				prob.solve(solver = cvx.MOSEK, mosek_params={mosek.dparam.optimizer_max_time: TIMEOUT}, verbose = VERBOSE)
+				prob.solve(solver = cvx.MOSEK, mosek_params={'MSK_DPAR_OPTIMIZER_MAX_TIME': TIMEOUT}, verbose = VERBOSE)
 			else:
 				prob.solve(solver = cvx.SCIPY, scipy_options = {'disp': VERBOSE, 'time_limit': TIMEOUT})
 			return np.array(s.value.round(), dtype = np.int64)
 		except cvx.SolverError:
 			self.log.append((time.time(),'ILP timeout'))
 
+	@timer
+	def ILP_hint(self):
+		"""ILP accelerated by hints of the Cauchy estimator
+
+		* coefficients of the Cauchy estimate with coefficient_confidence >= ILP_FIX_CONFIDENCE are fixed to their rounded value,
+		  if the post-processed estimate fulfills at least n equations exactly (otherwise the estimate is no reliable hint)
+		* every inlier fulfills |z_i - C_i s| <= bound_i := |z_i - C_i,fixed s_fixed| + eta * (free coefficients in the support of C_i).
+		  This is the per row big-M constant instead of K, it is at most |z_i| + tau * eta.
+		  Equations whose fixed residual already exceeds the free part are outliers and are removed.
+		* the post-processed estimate of cauchy_pp and its exactly fulfilled equations are passed as MIP start (if the solver supports it)
+		The Cauchy estimator gets TIMEOUT / 10 seconds, the solver the remaining time.
+
+		Output:
+			s|None: solution vector
+		"""
+		import cvxpy as cvx
+		start = time.time()
+		beta_est, weights = self._cauchy_irls(timeout = TIMEOUT / 10)
+		s_start = correct_least_confident(self.C, self.z, beta_est, weights, PP_COEFFICIENTS, self.eta)
+		confidence = coefficient_confidence(self.C, self.z, beta_est, weights)
+		fixed = (confidence >= ILP_FIX_CONFIDENCE) & (np.round(beta_est) == s_start)
+		if np.count_nonzero(self.z - self.C @ s_start == 0) < self.n: fixed[:] = False
+		free = ~fixed
+		if not free.any(): return s_start
+
+		residual_fixed = self.z - self.C[:, fixed] @ s_start[fixed]
+		bound = self.eta * np.count_nonzero(self.C[:, free], axis = 1)
+		rows = np.abs(residual_fixed) <= bound
+		self.log.append((time.time(), f'ILP_hint: {np.count_nonzero(fixed)} fixed coefficients, {np.count_nonzero(~rows)} outliers removed'))
+		C = self.C[rows][:, free].astype(np.float64)
+		K_rows = np.abs(residual_fixed[rows]) + bound[rows]
+
+		e = cvx.Variable(len(K_rows), boolean = True)
+		s = cvx.Variable(np.count_nonzero(free), integer = True)
+		residual = residual_fixed[rows] - C @ s
+		constraints = [s >= - self.eta, s <= self.eta, residual <= cvx.multiply(K_rows, 1-e), residual >= -cvx.multiply(K_rows, 1-e)]
+		prob = cvx.Problem(cvx.Maximize(cvx.sum(e)), constraints)
+		s.value = s_start[free]
+		e.value = (residual_fixed[rows] - C @ s_start[free] == 0).astype(float)
+		timeout = max(TIMEOUT - (time.time() - start), 1)
+		try:
+			if MOSEK_FLAG:
+				prob.solve(solver = cvx.MOSEK, mosek_params={'MSK_DPAR_OPTIMIZER_MAX_TIME': timeout}, verbose = VERBOSE, warm_start = True)
+			else:
+				prob.solve(solver = cvx.SCIPY, scipy_options = {'disp': VERBOSE, 'time_limit': timeout}, warm_start = True)
+			solution = s_start.copy()
+			solution[free] = s.value.round()
+			return solution
+		except cvx.SolverError:
+			self.log.append((time.time(),'ILP_hint timeout'))
+
 	def __str__(self):
 		"""create table of all computed results."""
+		from tabulate import tabulate
 		return tabulate([(name, t, solved, bits) for name, (t, solved, bits, _) in self.solutions.items()],['method', 'time', 'solved', 'correct bits'], tablefmt = 'grid')
 
+def coefficient_confidence(C, z, beta_est, weights):
+	"""Confidence of rounding the coefficients of a (weighted) least squares estimate
+
+	the distance of every coefficient to its rounding boundary, measured in standard deviations of the weighted least squares estimate,
+	i.e. sqrt(sigma^2 * diag((C^T W C)^-1)) with sigma^2 = sum(w * r^2) / (m - n).
+	Small values are likely rounded to the wrong integer.
+	"""
+	residuals = z - C @ beta_est
+	sigma2 = np.sum(weights * residuals**2) / max(len(z) - len(beta_est), 1)
+	variance = sigma2 * np.diag(np.linalg.pinv(C.T @ (C * weights.reshape(-1, 1))))
+	distance = 0.5 - np.abs(beta_est - np.round(beta_est))
+	return distance / np.sqrt(np.maximum(variance, 1e-300))
+
+def correct_least_confident(C, z, beta_est, weights, k, eta, chunk_size = 256):
+	"""Finish a nearly recovered key
+
+	ranks the coefficients by coefficient_confidence and enumerates the 2^k combinations of rounding the k least confident coefficients
+	to the nearest or to the second nearest integer in [-eta, eta].
+	Inliers of CILWE are fulfilled exactly, so the candidate with the most exactly fulfilled equations is kept and refined by refine_by_inliers.
+	"""
+	s = np.clip(np.round(beta_est), -eta, eta).astype(np.int64)
+	other = s + np.where(beta_est >= s, 1, -1)
+	valid = np.flatnonzero(np.abs(other) <= eta)
+	confidence = coefficient_confidence(C, z, beta_est, weights)
+	J = valid[np.argsort(confidence[valid])[:k]]
+	if len(J) == 0:
+		return s
+
+	# residuals of all candidates: z - C s - C_J delta
+	residuals = np.asarray(z - C @ s, dtype = np.int64)
+	C_J = np.asarray(C[:, J], dtype = np.int64)
+	candidates = (np.arange(1 << len(J)).reshape(-1, 1) >> np.arange(len(J))) & 1
+	deltas = candidates * (other[J] - s[J])
+	inliers = np.empty(len(deltas), dtype = np.int64)
+	for start in range(0, len(deltas), chunk_size):
+		R = residuals.reshape(-1, 1) - C_J @ deltas[start:start + chunk_size].T
+		inliers[start:start + chunk_size] = np.count_nonzero(R == 0, axis = 0)
+	s[J] += deltas[np.argmax(inliers)]
+	return refine_by_inliers(C, z, s, eta)
+
+def refine_by_inliers(C, z, s, eta):
+	"""Greedy correction of single coefficients
+
+	repeatedly applies the change of a single coefficient (within [-eta, eta]) that increases the number of exactly fulfilled equations the most.
+	Stops if no change increases it.
+	"""
+	s = s.copy()
+	C = np.asarray(C, dtype = np.int64)
+	residuals = np.asarray(z - C @ s, dtype = np.int64)
+	support = C != 0
+	changes = np.array([d for d in range(-2 * eta, 2 * eta + 1) if d != 0])
+	while True:
+		lost = np.count_nonzero(support & (residuals == 0).reshape(-1, 1), axis = 0)
+		gains = np.stack([np.count_nonzero(support & (residuals.reshape(-1, 1) == C * d), axis = 0) - lost for d in changes])
+		gains[np.abs(s + changes.reshape(-1, 1)) > eta] = -1
+		k, j = np.unravel_index(np.argmax(gains), gains.shape)
+		if gains[k, j] <= 0:
+			return s
+		s[j] += changes[k]
+		residuals -= C[:, j] * changes[k]
+
+SUMMARY_TABLE = '''
+create table if not exists summary(
+	method_id integer references method(rowid), p float, eta integer, tau integer, m integer, total integer, solved integer,
+	primary key (method_id, p, eta, tau, m));'''
+
+SUMMARY_UPSERT = '''
+insert into summary (method_id, p, eta, tau, m, total, solved) select rowid, ?, ?, ?, ?, 1, ? from method where name = ?
+on conflict (method_id, p, eta, tau, m) do update set total = total + 1, solved = solved + excluded.solved;'''
+
+CELL_TABLE = '''
+create table if not exists cell(
+	p float, eta integer, tau integer, m integer, instances integer,
+	primary key (p, eta, tau, m));'''
+
+CELL_UPSERT = '''
+insert into cell (p, eta, tau, m, instances) values (?, ?, ?, ?, 1)
+on conflict (p, eta, tau, m) do update set instances = instances + 1;'''
+
+METHODS = ('ILP', 'L1', 'huber', 'cauchy', 'L2', 'cauchy_pp', 'ILP_hint') # rows of the method table, in the order of init.sql
+
+def ensure_views(cursor):
+	"""Drop and recreate the views of init.sql, so existing databases get the views of new methods"""
+	with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'init.sql')) as f:
+		script = ''.join(line for line in f if not line.lstrip().startswith('--'))
+	views = [statement.strip() for statement in script.split(';') if statement.strip().lower().startswith('create view')]
+	for view in views:
+		cursor.execute(f'drop view if exists {view.split()[2]};')
+	for view in views:
+		cursor.execute(view)
+
+def ensure_summary(cursor, conn):
+	"""Bring databases created by an older init.sql up to date
+
+	* insert the rows of new methods into method, run_all only runs methods that have a row
+	* recreate the views (ensure_views)
+	* create the summary table and backfill it from run if it is out of sync
+	* create the cell table and backfill it from instance if it is out of sync
+	"""
+	for name in METHODS:
+		cursor.execute('insert into method (name) select ? where not exists (select 1 from method where name = ?);', (name, name))
+	ensure_views(cursor)
+	cursor.execute(SUMMARY_TABLE)
+	cursor.execute('select (select count(*) from run), (select coalesce(sum(total), 0) from summary);')
+	runs, summarised = cursor.fetchone()
+	if runs != summarised:
+		cursor.execute('delete from summary;')
+		cursor.execute('''
+			insert into summary (method_id, p, eta, tau, m, total, solved)
+			select method_id, p, eta, tau, m, count(*), sum(solved) from run join instance on instance_id = instance.rowid
+			group by method_id, p, eta, tau, m;''')
+	cursor.execute(CELL_TABLE)
+	cursor.execute('select (select count(*) from instance), (select coalesce(sum(instances), 0) from cell);')
+	instances, counted = cursor.fetchone()
+	if instances != counted:
+		cursor.execute('delete from cell;')
+		cursor.execute('insert into cell (p, eta, tau, m, instances) select p, eta, tau, m, count(*) from instance group by p, eta, tau, m;')
+	conn.commit()
+
 def run_method(n, m, p, eta, tau, cursor, conn, method : str):
 	"""Get the instance with given parameters from DB and run given method on it."""
 	cursor.execute('select seed from instance, run, method where method_id = method.rowid and instance_id = instance.rowid and m = ? and n = ? and p = ? and eta = ? and tau = ? and method.name = ?;', (m,n,p,eta,tau,method))
 	seeds_done = [_[0] for _ in cursor.fetchall()]
-	fails = 0
+	fails, runs = 0, len(seeds_done)
+	# the ETA of the cell assumes all ATTEMPTS runs, it ends earlier if too many fail
+	METRICS.set('cell_m', m, method = method, p = p)
+	METRICS.progress('cell', runs, ATTEMPTS, method = method, p = p)
 	for seed in range(ATTEMPTS):
 		if seed in seeds_done: continue
 		# Main loop, create next instance, run all methods and put results into database
 		if open('status').read().strip() != 'run': break
-		instance_id, instance = get_instance(m, n, eta, tau, p, seed, cursor, conn)
+		with METRICS.timer('instance_seconds'):
+			instance_id, instance = get_instance(m, n, eta, tau, p, seed, cursor, conn)
 		_, runtime, success = getattr(instance, method)()
 		success = int(success)
 		cursor.execute('insert into run (instance_id, method_id,time,solved,timestamp) select ?,rowid,?,?,? from method where name = ?;', (instance_id, runtime, success, int(time.time()), method))
+		cursor.execute(SUMMARY_UPSERT, (p, eta, tau, m, success, method))
 		conn.commit()
 		fails += (1-success)
+		runs += 1
+		METRICS.inc('runs', method = method, solved = success)
+		METRICS.observe('solver_seconds', runtime, method = method)
+		METRICS.progress('cell', runs, ATTEMPTS, method = method, p = p)
 		if fails >= round((1 - SUCCESS_THRESHOLD) * ATTEMPTS): break
 
 def get_instance(m, n, eta, tau, p, seed, cursor, conn):
@@ -231,12 +471,61 @@ def get_instance(m, n, eta, tau, p, seed, cursor, conn):
 
 	cursor.execute('insert into instance (m,n,eta,tau,p,seed,errors) values (?,?,?,?,?,?,?);', (m, n, eta, tau, p, seed, instance.k))
 	instance_id = cursor.lastrowid
+	cursor.execute(CELL_UPSERT, (p, eta, tau, m))
 	conn.commit()
 	return instance_id, instance
 
+def next_m(cursor, method_id, p, eta, tau, method = ''):
+	"""Next number of equations m to run for the bisection of the smallest m with success rate >= SUCCESS_THRESHOLD
+
+	reads the summary table, so it can be called repeatedly (also by the coordinator of workqueue.py) and returns
+	* m of a cell with less than ATTEMPTS runs that did not fail too often yet (finish interrupted cells)
+	* while no m succeeds: an upper bound, doubling the largest m so far
+	* else: the middle of the largest failing and the smallest succeeding m
+	* None if the bisection is finished
+	"""
+	# setting an upper bound, by always doubling the maximum
+	cursor.execute('''
+		select m, solved, total, 1.0*solved/total as chance
+		from summary
+		where method_id = ? and p = ? and eta = ? and tau = ?;''', (method_id, p, eta, tau))
+	results = cursor.fetchall()
+	# compute all parameter with less than N instances
+	gaps = [row for row in results if row[2] < ATTEMPTS and row[2] - row[1] < round((1 - SUCCESS_THRESHOLD) * ATTEMPTS)]
+	if gaps != []:
+		return min(row[0] for row in gaps)
+	if not any(float(row[-1]) >= SUCCESS_THRESHOLD for row in results):
+		if results == []:
+			# no instance tested for these parameters, yet
+			return int(DIMENSION / (1 - p))
+		m = 2*max(row[0] for row in results)
+		if m >= 41000:
+			print(f'{method} has no bound for {p}')
+			return None
+		return m
+
+	# actual bisection
+	cursor.execute('''
+		select m,eta,tau,p,solved,total, printf("%.3f", 1.0*solved/total) as chance
+		from summary
+		where method_id = ? and p = ? and eta = ? and tau = ?;''', (method_id, p, eta, tau))
+	results = cursor.fetchall()
+	m_good = min(row[0] for row in results if float(row[-1]) >= SUCCESS_THRESHOLD)
+	try:
+		m_bad = max(row[0] for row in results if float(row[-1]) < SUCCESS_THRESHOLD)
+	except ValueError:
+		#256 is lower bound for fail
+		m_bad = 256
+	if float(m_good) / m_bad <= 1.01:
+		return None
+	return (m_good + m_bad) >> 1
+
 def run_all():
+	from plot import plot
+	METRICS.start(port = METRICS_PORT, path = METRICS_FILE, host = METRICS_HOST)
 	conn = sqlite3.connect('data/runs.db')
 	cursor = conn.cursor()
+	ensure_summary(cursor, conn)
 
 	# dictionary for all methods with their ID in database
 	dummy_instance = ILWE(300, 0.05, DIMENSION, ETA, TAU, 0)
@@ -245,55 +534,15 @@ def run_all():
 	methods = {name: ID for ID,name in cursor.fetchall() if name in active_methods}
 
 	# bisection, how large m has to be for given success threshold
+	searches = 0
 	for method in methods.keys():
-		for p in [0.01,0.05,0.1,0.15,0.2,0.25,0.3,0.35,0.4,0.45,0.5,0.55,0.6,0.65,0.7,0.75,0.8,0.85,0.9]:
-		# setting an upper bound, by always doubling the maximum
-			while True:
-				if open('status').read().strip() != 'run': break
-				cursor.execute('''
-					select m, sum(solved) as solved, count(*) as count, 1.0*sum(solved)/count(*) as chance
-					from instance left join run on instance_id = instance.rowid
-					where method_id = ? and p = ? and eta = ? and tau = ? 
-					group by m, p, eta, tau;''', (methods[method], p, ETA, TAU))
-				results = cursor.fetchall()
-				# compute all parameter with less than N instances
-				gaps = [row for row in results if row[2] < ATTEMPTS and row[2] - row[1] < round((1 - SUCCESS_THRESHOLD) * ATTEMPTS)]
-				if gaps != []:
-					for row in gaps:
-						run_method(DIMENSION, row[0], p, ETA, TAU, cursor, conn, method)
-				else:
-					if any(float(row[-1]) >= SUCCESS_THRESHOLD for row in results): break # found an upper bound, continue with next part
-					if results == []:
-						# no instance tested for these parameters, yet
-						m = int(DIMENSION / (1 - p))
-					else:
-						m = 2*max(row[0] for row in results)
-						if m >= 41000: break
-					run_method(DIMENSION, m, p, ETA, TAU, cursor, conn, method)
-
-			# actual bisection
-			while True:
-				if open('status').read().strip() != 'run': break
-				cursor.execute('''
-					select m,eta,tau,p,sum(solved) as solved,count(*) as count, printf("%.3f", 1.0*sum(solved)/count(*)) as chance
-					from instance left join run on instance_id = instance.rowid
-					where method_id = ? and p = ? and eta = ? and tau = ? 
-					group by m,p, eta, tau;''', (methods[method], p, ETA, TAU))
-				results = cursor.fetchall()
-				try:
-					m_good = min(row[0] for row in results if float(row[-1]) >= SUCCESS_THRESHOLD)
-				except ValueError: # no upper bound
-					print(f'{method} has no bound for {p}')
-					break
-				try:
-					m_bad = max(row[0] for row in results if float(row[-1]) < SUCCESS_THRESHOLD)
-				except ValueError:
-					#256 is lower bound for fail
-					m_bad = 256
-				if float(m_good) / m_bad <= 1.01:
-					break
-				m = (m_good + m_bad) >> 1
+		for p in CONTAMINATIONS:
+			while open('status').read().strip() == 'run':
+				m = next_m(cursor, methods[method], p, ETA, TAU, method)
+				if m is None: break
 				run_method(DIMENSION, m, p, ETA, TAU, cursor, conn, method)
+			searches += 1
+			METRICS.progress('searches', searches, len(methods) * len(CONTAMINATIONS))
 			plot(NIST_LEVEL)
 
 	conn.close()
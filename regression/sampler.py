@@ -39,20 +39,21 @@ def generate_e(n, tau, q, beta, A, filterthresh):
 					break
 	return e
 
-def generate_A(n, p, tau):
+def generate_A(n, p, tau, dtype = np.float64):
 	'''generates the data matrix:
 	n: number of samples (Dilithium: m)
 	p: dimensions (Dilithum: n)
 	tau: the number of non-zeros in Data matrix (Dilithum tau)
+	dtype: of the Data matrix, e.g. np.int8 (entries are in {-1, 0, 1})
 	
 	return the Data matrix (Dilithium: C)'''
-	A = np.zeros((n, p))
+	A = np.zeros((n, p), dtype = dtype)
 	for i in range(n):
 		non_zero_indices = np.random.choice(p, tau, replace=False)
 		A[i, non_zero_indices] = np.random.choice([-1, 1], tau)
 	return A
 
-def generate_sample(n, tau, q, beta = None, dim = 256, eta = 2, filterthresh = 39):
+def generate_sample(n, tau, q, beta = None, dim = 256, eta = 2, filterthresh = 39, compact = False):
 	'''generates a proper sample using rejection sampling
 	
 	n: number of samples (Dilithium: m)
@@ -62,6 +63,7 @@ def generate_sample(n, tau, q, beta = None, dim = 256, eta = 2, filterthresh = 3
 	dim: number of dimensions (Dilithium: n)
 	eta: draws key coefficients between -eta and +eta
 	filtherthresh: The maximum value of the output (Dilithium: z). Should be set to 2*sqrt(2*tau)
+	compact: returns the data matrix as int8, output and error vector as int16 (same sample for the same random state)
 
 	returns:
 		the data matrix (Dilithium: C)
@@ -70,7 +72,8 @@ def generate_sample(n, tau, q, beta = None, dim = 256, eta = 2, filterthresh = 3
 		the secret key used (Dilithium: s)
 	'''
 	p=dim
-	A = generate_A(n, p, tau)
+	dtype = np.int8 if compact else np.float64
+	A = generate_A(n, p, tau, dtype = dtype)
 	if beta is None:
 		beta = keygen(length = dim, eta = eta)
 	e = generate_e(n, tau, q, beta, A, filterthresh)
@@ -87,11 +90,14 @@ def generate_sample(n, tau, q, beta = None, dim = 256, eta = 2, filterthresh = 3
 		A = A[mask]
 		e = e[mask]
 		#generate missing equations without error
-		A_prime = generate_A(n-len(b), p, tau)
+		A_prime = generate_A(n-len(b), p, tau, dtype = dtype)
 		b_prime = A_prime@beta
 		#concat with next loop check if valid equations
 		A = np.vstack([A,A_prime])
 		b = np.concatenate([b, b_prime])
 		e = np.concatenate([e, np.zeros_like(b_prime)])
 
+	if compact:
+		# |b| <= filterthresh and |e| < 4 * tau + filterthresh
+		return A,b.astype(np.int16),e.astype(np.int16),beta
 	return A,b,e,beta
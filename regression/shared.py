@@ -0,0 +1,112 @@
+"""
+Zero-copy transport of large arrays (e.g. C, z) to worker processes
+
+The parent copies the arrays once into named shared memory blocks (or memory-mapped .npy files) and only sends the small handles to the workers,
+which attach read-only views by name instead of unpickling a copy per task.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import weakref
+import numpy as np
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+def _unlink(blocks, directory):
+	"""release the resources of SharedArrays, also called by the finalizer if close was never called"""
+	for shm in blocks:
+		shm.close()
+		try:
+			shm.unlink()
+		except FileNotFoundError:
+			pass
+	if directory is not None:
+		shutil.rmtree(directory, ignore_errors = True)
+
+class SharedArrays:
+	"""Named arrays owned by the parent process
+
+	arrays: dictionary name -> array
+	backend: 'shm' for multiprocessing.shared_memory, 'mmap' for memory-mapped .npy files in directory (default: new temporary directory)
+
+	use as context manager (or call close) to free the memory, handles can be sent to workers which call attach(handles)
+	"""
+	def __init__(self, arrays, backend = 'shm', directory = None):
+		self.backend = backend
+		self.handles = {}
+		self._blocks = []
+		self._directory = None
+		if backend == 'mmap':
+			self._directory = tempfile.mkdtemp(prefix = 'shared_', dir = directory)
+		for name, array in arrays.items():
+			array = np.ascontiguousarray(array)
+			if backend == 'shm':
+				shm = SharedMemory(create = True, size = max(array.nbytes, 1))
+				self._blocks.append(shm)
+				np.ndarray(array.shape, dtype = array.dtype, buffer = shm.buf)[...] = array
+				self.handles[name] = ('shm', shm.name, array.shape, array.dtype.str)
+			elif backend == 'mmap':
+				path = os.path.join(self._directory, name + '.npy')
+				np.lib.format.open_memmap(path, mode = 'w+', dtype = array.dtype, shape = array.shape)[...] = array
+				self.handles[name] = ('mmap', path, array.shape, array.dtype.str)
+			else:
+				raise ValueError(f'unknown backend {backend}')
+		self._finalizer = weakref.finalize(self, _unlink, self._blocks, self._directory)
+
+	def close(self):
+		"""free the shared memory, attached workers must have detached before"""
+		self._finalizer()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+def _attach_shm(name):
+	"""attach an existing block without registering it with the resource tracker, the owner unlinks it"""
+	if sys.version_info >= (3, 13):
+		return SharedMemory(name = name, track = False)
+	register = resource_tracker.register
+	resource_tracker.register = lambda *args, **kwargs: None
+	try:
+		return SharedMemory(name = name)
+	finally:
+		resource_tracker.register = register
+
+class Attached:
+	"""read-only views of the arrays of SharedArrays in a worker, use as context manager (or call close) to detach"""
+	def __init__(self, handles):
+		self.arrays = {}
+		self._blocks = []
+		for name, (backend, location, shape, dtype) in handles.items():
+			if backend == 'shm':
+				shm = _attach_shm(location)
+				self._blocks.append(shm)
+				array = np.ndarray(shape, dtype = np.dtype(dtype), buffer = shm.buf)
+			else:
+				array = np.load(location, mmap_mode = 'r')
+			array.flags.writeable = False
+			self.arrays[name] = array
+
+	def close(self):
+		"""drop the views and detach from the shared memory"""
+		self.arrays.clear()
+		for shm in self._blocks:
+			try:
+				shm.close()
+			except BufferError:
+				# views are still referenced elsewhere, the mapping is released when the process exits
+				pass
+		self._blocks = []
+
+	def __enter__(self):
+		return self.arrays
+
+	def __exit__(self, *exc):
+		self.close()
+
+def attach(handles):
+	"""attach the arrays of SharedArrays(...).handles, returns Attached"""
+	return Attached(handles)
@@ -0,0 +1,296 @@
+"""
+Distributed experiment sweep with a lease-based work queue on a shared filesystem
+
+One coordinator owns the database and places units (method, level, p, m, seed) as json files into the queue directory,
+any number of workers on other hosts (mounting the same directory) claim, run and report them:
+
+	queue/pending/  units to run
+	queue/leased/   units claimed by a worker (atomic rename from pending), their mtime is the heartbeat of the worker
+	queue/done/     results of the workers (<unit>@<worker>.json), merged into the database by the coordinator
+	queue/merged/   merged results, removed after KEEP seconds
+	queue/failed/   reports of runs that raised, removed after KEEP seconds
+	queue/stop      written by the coordinator when the sweep is finished, workers exit
+
+leases without heartbeat for longer than the lease time are moved back to pending. A unit that is reported twice
+(e.g. by a worker with an expired lease) is merged only once, an instance never gets two runs of the same method.
+A unit whose run raises is reported as failed and placed into pending again, after ATTEMPTS_MAX failed attempts it is
+merged as unsolved run (as ILWE.timer does for a failing solver), so the bisection of its cell continues.
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import traceback
+
+import regression
+from regression import ILWE, ATTEMPTS, DIMENSION, NIST_PARAMS, CONTAMINATIONS, SUMMARY_UPSERT, CELL_UPSERT, ensure_summary, next_m
+from metrics import METRICS
+
+STATES = ('pending', 'leased', 'done', 'merged', 'failed')
+UNIT = ('method', 'n', 'eta', 'tau', 'p', 'm', 'seed') # keys of a unit, a result adds its data to them
+LEASE = 600 # seconds without heartbeat until a lease expires, must be larger than a few heartbeats (LEASE/4) and the clock skew of the hosts
+POLL = 5 # seconds between two cycles of the coordinator or attempts of an idle worker
+ATTEMPTS_MAX = 3 # failed attempts of a unit until it is merged as unsolved run
+KEEP = 24*3600 # seconds until merged results and failure reports are removed
+
+def unit_name(method, eta, tau, p, m, seed):
+	"""file name of a unit, identical for all hosts and states"""
+	return f'{method}_{eta}_{tau}_{p}_{m}_{seed}.json'
+
+def make_queue(queue):
+	"""create the directories of the queue"""
+	for state in STATES:
+		os.makedirs(os.path.join(queue, state), exist_ok = True)
+
+def write_atomic(path, data):
+	"""write json data to path, visible to other hosts only when complete"""
+	tmp = f'{path}.{socket.gethostname()}.{os.getpid()}.tmp'
+	with open(tmp, 'w') as f:
+		json.dump(data, f)
+	os.rename(tmp, path)
+
+def result_name(name, worker_id):
+	"""file name of the result of unit name reported by worker_id"""
+	return f'{name[:-len(".json")]}@{worker_id}.json'
+
+def queued_units(queue):
+	"""names of all units in the queue in any state"""
+	names = set()
+	for state in STATES:
+		for name in os.listdir(os.path.join(queue, state)):
+			if name.endswith('.tmp'): continue
+			names.add(name.split('@')[0].removesuffix('.json') + '.json')
+	return names
+
+# WORKER
+
+def claim(queue):
+	"""claim the next pending unit by renaming it into leased, returns its name and content or None if nothing is pending"""
+	for name in sorted(os.listdir(os.path.join(queue, 'pending'))):
+		if name.endswith('.tmp'): continue
+		pending = os.path.join(queue, 'pending', name)
+		leased = os.path.join(queue, 'leased', name)
+		try:
+			# rename keeps the mtime, so renew it before, otherwise an old unit would be requeued as expired lease
+			os.utime(pending)
+			# rename is atomic, exactly one worker succeeds
+			os.rename(pending, leased)
+		except FileNotFoundError:
+			continue
+		with open(leased) as f:
+			return name, json.load(f)
+	return None
+
+def heartbeat(path, stop, interval):
+	"""renew the lease on path until stop is set, the coordinator may have requeued it meanwhile"""
+	while not stop.wait(interval):
+		try:
+			os.utime(path)
+		except FileNotFoundError:
+			return
+
+def run_unit(unit):
+	"""create the instance of unit and run its method, returns the result data for the coordinator"""
+	with METRICS.timer('instance_seconds'):
+		instance = ILWE(unit['m'], unit['p'], n = unit['n'], eta = unit['eta'], tau = unit['tau'], seed = unit['seed'])
+	_, runtime, success = getattr(instance, unit['method'])()
+	METRICS.inc('runs', method = unit['method'], solved = int(success))
+	METRICS.observe('solver_seconds', runtime, method = unit['method'])
+	return dict(unit, errors = int(instance.k), time = runtime, solved = int(success), timestamp = int(time.time()))
+
+def worker(queue, lease = LEASE, worker_id = None):
+	"""run units of the queue until the coordinator writes the stop file"""
+	worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+	while not os.path.exists(os.path.join(queue, 'stop')):
+		claimed = claim(queue)
+		if claimed is None:
+			METRICS.inc('idle_seconds', POLL)
+			time.sleep(POLL)
+			continue
+		name, unit = claimed
+		leased = os.path.join(queue, 'leased', name)
+		stop = threading.Event()
+		beat = threading.Thread(target = heartbeat, args = (leased, stop, lease / 4), daemon = True)
+		beat.start()
+		start = time.time()
+		try:
+			result = run_unit(unit)
+		except Exception as err:
+			# report the failure instead of dying with the lease, which would requeue the unit forever
+			traceback.print_exc()
+			METRICS.inc('failed', method = unit['method'])
+			result = dict(unit, errors = None, time = time.time() - start, solved = 0, timestamp = int(time.time()), error = repr(err))
+		finally:
+			stop.set()
+			beat.join()
+		result['worker'] = worker_id
+		write_atomic(os.path.join(queue, 'done', result_name(name, worker_id)), result)
+		try:
+			os.remove(leased)
+		except FileNotFoundError:
+			# lease expired and requeued, the result is merged only once
+			pass
+		print(worker_id, name, 'failed' if 'error' in result else 'solved' if result['solved'] else 'unsolved', f'{result["time"]:.1f}s', flush = True)
+
+# COORDINATOR
+
+def requeue_expired(queue, lease):
+	"""move leases without heartbeat back to pending, returns their number"""
+	count = 0
+	for name in os.listdir(os.path.join(queue, 'leased')):
+		path = os.path.join(queue, 'leased', name)
+		try:
+			if time.time() - os.path.getmtime(path) <= lease: continue
+			os.rename(path, os.path.join(queue, 'pending', name))
+		except FileNotFoundError:
+			# finished meanwhile
+			continue
+		count += 1
+	return count
+
+def merge(queue, cursor, conn):
+	"""merge the results in done into the database and move them to merged, returns the number of new runs
+
+	a failure report (key error) places its unit into pending again with one more attempt and is moved to failed,
+	the last of ATTEMPTS_MAX failed attempts is merged as unsolved run
+	"""
+	count = 0
+	for name in sorted(os.listdir(os.path.join(queue, 'done'))):
+		if name.endswith('.tmp'): continue
+		path = os.path.join(queue, 'done', name)
+		with open(path) as f:
+			r = json.load(f)
+		cursor.execute('select rowid from instance where m = ? and n = ? and p = ? and eta = ? and tau = ? and seed = ?;', (r['m'], r['n'], r['p'], r['eta'], r['tau'], r['seed']))
+		instance_id = cursor.fetchone()
+		instance_id = None if instance_id is None else instance_id[0]
+		merged = False
+		if instance_id is not None:
+			cursor.execute('select count(*) from run join method on method_id = method.rowid where instance_id = ? and name = ?;', (instance_id, r['method']))
+			merged = cursor.fetchone()[0] > 0
+		attempts = r.get('attempts', 0) + 1
+		if 'error' in r and not merged and attempts < ATTEMPTS_MAX:
+			print(name, 'failed:', r['error'], f'(attempt {attempts} of {ATTEMPTS_MAX})', flush = True)
+			write_atomic(os.path.join(queue, 'pending', name.split('@')[0] + '.json'), dict({key: r[key] for key in UNIT}, attempts = attempts))
+			os.rename(path, os.path.join(queue, 'failed', name))
+			continue
+		if instance_id is None:
+			cursor.execute('insert into instance (m,n,eta,tau,p,seed,errors) values (?,?,?,?,?,?,?);', (r['m'], r['n'], r['eta'], r['tau'], r['p'], r['seed'], r['errors']))
+			instance_id = cursor.lastrowid
+			cursor.execute(CELL_UPSERT, (r['p'], r['eta'], r['tau'], r['m']))
+		if not merged:
+			cursor.execute('insert into run (instance_id, method_id,time,solved,timestamp) select ?,rowid,?,?,? from method where name = ?;', (instance_id, r['time'], r['solved'], r['timestamp'], r['method']))
+			cursor.execute(SUMMARY_UPSERT, (r['p'], r['eta'], r['tau'], r['m'], r['solved'], r['method']))
+			count += 1
+		conn.commit()
+		os.rename(path, os.path.join(queue, 'failed' if 'error' in r else 'merged', name))
+	return count
+
+def prune(queue, keep = KEEP):
+	"""remove merged results and failure reports older than keep seconds, the database holds their runs"""
+	for state in ('merged', 'failed'):
+		for name in os.listdir(os.path.join(queue, state)):
+			path = os.path.join(queue, state, name)
+			try:
+				if time.time() - os.path.getmtime(path) > keep:
+					os.remove(path)
+			except FileNotFoundError:
+				pass
+
+def record_queue(queue, active, merged, expired):
+	"""update the metrics of the coordinator after a cycle, see metrics.py"""
+	for state in STATES:
+		METRICS.set('queue', sum(not name.endswith('.tmp') for name in os.listdir(os.path.join(queue, state))), state = state)
+	METRICS.set('active_units', len(active))
+	METRICS.inc('merged', merged)
+	METRICS.inc('requeued', expired)
+
+def enqueue(queue, cursor, method, p, m, eta, tau, queued):
+	"""place all seeds of the cell that are neither in the database nor in the queue, returns the names of the cell"""
+	cursor.execute('select seed from instance, run, method where method_id = method.rowid and instance_id = instance.rowid and m = ? and n = ? and p = ? and eta = ? and tau = ? and method.name = ?;', (m, DIMENSION, p, eta, tau, method))
+	seeds_done = set(_[0] for _ in cursor.fetchall())
+	# the ETA of the cell assumes all ATTEMPTS runs, it ends earlier if too many fail
+	METRICS.set('cell_m', m, method = method, p = p, eta = eta, tau = tau)
+	METRICS.progress('cell', len(seeds_done), ATTEMPTS, method = method, p = p, eta = eta, tau = tau)
+	names = set()
+	for seed in range(ATTEMPTS):
+		name = unit_name(method, eta, tau, p, m, seed)
+		names.add(name)
+		if seed in seeds_done or name in queued: continue
+		write_atomic(os.path.join(queue, 'pending', name), dict(method = method, n = DIMENSION, eta = eta, tau = tau, p = p, m = m, seed = seed))
+	return names
+
+def cancel(queue, keep):
+	"""remove pending units not in keep (cells that are finished or failed too often), leased units are finished"""
+	for name in os.listdir(os.path.join(queue, 'pending')):
+		if name.endswith('.tmp') or name in keep: continue
+		try:
+			os.remove(os.path.join(queue, 'pending', name))
+		except FileNotFoundError:
+			pass
+
+def coordinator(queue, levels, lease = LEASE, database = 'data/runs.db', keep = KEEP):
+	"""advance the bisection of all (method, level, p) at once by distributing their current cells to the workers
+
+	Similar to run_all in regression.py, but with all searches in parallel and the runs done by worker processes
+	"""
+	from plot import plot
+	make_queue(queue)
+	if os.path.exists(os.path.join(queue, 'stop')):
+		os.remove(os.path.join(queue, 'stop'))
+	conn = sqlite3.connect(database)
+	cursor = conn.cursor()
+	ensure_summary(cursor, conn)
+	dummy_instance = ILWE(300, 0.05, DIMENSION, seed = 0)
+	active_methods = list(dummy_instance.methods.keys())
+	cursor.execute('select rowid, name from method;')
+	methods = {name: ID for ID,name in cursor.fetchall() if name in active_methods}
+
+	finished = set() # (level, method, p) of finished searches
+	while open('status').read().strip() == 'run':
+		expired = requeue_expired(queue, lease)
+		merged = merge(queue, cursor, conn)
+		prune(queue, keep)
+		queued = queued_units(queue)
+		active = set()
+		for level in levels:
+			eta, tau = NIST_PARAMS[level]
+			for method in methods:
+				for p in CONTAMINATIONS:
+					if (level, method, p) in finished: continue
+					m = next_m(cursor, methods[method], p, eta, tau, method)
+					if m is None:
+						finished.add((level, method, p))
+						continue
+					active |= enqueue(queue, cursor, method, p, m, eta, tau, queued)
+		cancel(queue, active)
+		record_queue(queue, active, merged, expired)
+		if merged:
+			for level in levels:
+				plot(level)
+		print(f'{len(active)} active units, {merged} merged, {expired} requeued', flush = True)
+		if not active:
+			# sweep finished, let the workers exit
+			open(os.path.join(queue, 'stop'), 'w').close()
+			break
+		time.sleep(POLL)
+	conn.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser('distributed CILWE experiment with a file-based work queue')
+	parser.add_argument('role', choices = ['coordinator', 'worker'])
+	parser.add_argument('--queue', default = 'data/queue', help = 'queue directory on a filesystem shared by all hosts')
+	parser.add_argument('--lease', type = float, default = LEASE, help = 'seconds without heartbeat until a unit is requeued')
+	parser.add_argument('--levels', type = int, nargs = '+', default = [regression.NIST_LEVEL], choices = list(NIST_PARAMS), help = 'NIST levels of the coordinator')
+	parser.add_argument('--database', default = 'data/runs.db', help = 'database of the coordinator')
+	parser.add_argument('--keep', type = float, default = KEEP, help = 'seconds until the coordinator removes merged results and failure reports')
+	parser.add_argument('--metrics_port', type = int, default = None, help = 'serve live metrics (Prometheus text) on this port, see metrics.py')
+	parser.add_argument('--metrics_file', default = None, help = 'write live metrics as JSON to this file every few seconds')
+	args = parser.parse_args()
+	METRICS.start(port = args.metrics_port, path = args.metrics_file, host = regression.METRICS_HOST)
+	if args.role == 'coordinator':
+		coordinator(args.queue, args.levels, args.lease, args.database, args.keep)
+	else:
+		worker(args.queue, args.lease)
@@ -0,0 +1,134 @@
+'''Compact on-disk format for CILWE equations z = <C_i, s> + y
+
+Every row of the rotation matrix C of a challenge c is fully determined by c and the coefficient index of the row.
+Instead of storing n-length rows, an equation only stores the tau non-zero positions of c with their signs.
+A store is a directory with one .npy file per column
+(the same layout as the output of the data generator in attack/data_generator):
+* c.npy: (m, tau) int16, signed positions sign * (position + 1) of the non-zero coefficients of c
+* coeff.npy: (m,) uint8, coefficient index of the equation, i.e. the row of C
+* poly.npy: (m,) uint8, polynomial index l
+* sig.npy: (m,) int32, number of the signature the equation belongs to, non-decreasing
+* z.npy: (m,) int32, public coefficient z
+* y.npy: (m,) int32, label / error coefficient y
+* s1.npy: (l, n) optional, secret key
+
+Rows are expanded on demand with expand_dense or expand_sparse.
+'''
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+
+COLUMNS = ("c", "coeff", "poly", "sig", "z", "y")
+
+
+def encode_challenge(positions, signs):
+	'''signed positions of a sparse challenge (see gen_c_sparse)'''
+	return (np.asarray(signs, dtype = np.int16) * (np.asarray(positions, dtype = np.int16) + 1)).astype(np.int16)
+
+def compress_challenges(c):
+	'''turns dense challenges of shape (m, n) with tau non-zeros each into signed positions of shape (m, tau)'''
+	c = np.asarray(c)
+	rows, positions = np.nonzero(c)
+	tau = np.count_nonzero(c[0]) if len(c) else 0
+	assert len(positions) == tau * len(c), "all challenges need the same number of non-zero coefficients"
+	return encode_challenge(positions, np.sign(c[rows, positions])).reshape(len(c), tau)
+
+def rows_to_challenges(C):
+	'''
+	finds challenges c' with C[i] = calculate_c_matrix_np(c')[0] for rows of rotation matrices without known coefficient index.
+	Store the result with coeff = 0.
+	'''
+	C = np.asarray(C)
+	c = np.empty_like(C)
+	c[:, 0] = C[:, 0]
+	c[:, 1:] = -C[:, :0:-1]
+	return compress_challenges(c)
+
+def row_support(c, coeff, n = 256):
+	"""
+	column indices and values of the non-zero entries of the rows coeff of the rotation matrices of c.
+	c: (m, tau) signed positions, coeff: (m,) row indices
+	returns cols (m, tau) and vals (m, tau) with entries in {-1, 1}
+	"""
+	c = np.asarray(c)
+	positions = np.abs(c).astype(np.int32) - 1
+	idx = np.asarray(coeff, dtype = np.int32).reshape(-1, 1)
+	cols = (idx - positions) % n
+	vals = np.sign(c).astype(np.int8)
+	vals = np.where(positions > idx, -vals, vals)
+	return cols, vals
+
+def expand_dense(c, coeff, n = 256, dtype = np.float64):
+	'''builds the dense rows of C, shape (m, n)'''
+	cols, vals = row_support(c, coeff, n)
+	rows = np.zeros((len(cols), n), dtype = dtype)
+	np.put_along_axis(rows, cols, vals.astype(dtype), axis = 1)
+	return rows
+
+def expand_sparse(c, coeff, n = 256, dtype = np.float64):
+	'''builds the rows of C as scipy.sparse.csr_matrix, shape (m, n)'''
+	cols, vals = row_support(c, coeff, n)
+	m, tau = cols.shape
+	indptr = np.arange(0, (m + 1) * tau, tau, dtype = np.int64)
+	return csr_matrix((vals.ravel().astype(dtype), cols.ravel(), indptr), shape = (m, n))
+
+def save_equations(path, c, coeff, poly, sig, z, y, s1 = None):
+	'''writes a store to the directory path'''
+	os.makedirs(path, exist_ok = True)
+	columns = {
+		"c": np.asarray(c, dtype = np.int16),
+		"coeff": np.asarray(coeff, dtype = np.uint8),
+		"poly": np.asarray(poly, dtype = np.uint8),
+		"sig": np.asarray(sig, dtype = np.int32),
+		"z": np.asarray(z, dtype = np.int32),
+		"y": np.asarray(y, dtype = np.int32),
+	}
+	for name, column in columns.items():
+		np.save(os.path.join(path, name + ".npy"), column)
+	if s1 is not None:
+		np.save(os.path.join(path, "s1.npy"), np.asarray(s1))
+
+def load_equations(path, mmap_mode = "r"):
+	'''loads a store as dictionary of columns. The columns are memory mapped by default, so loading is free.'''
+	store = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode = mmap_mode) for name in COLUMNS}
+	if os.path.isfile(os.path.join(path, "s1.npy")):
+		store["s1"] = np.load(os.path.join(path, "s1.npy"))
+	return store
+
+def is_store(path):
+	'''checks if path is a directory written by save_equations'''
+	return all(os.path.isfile(os.path.join(path, name + ".npy")) for name in COLUMNS)
+
+def slice_signatures(store, no_sigs):
+	'''returns the store restricted to the equations of the first no_sigs signatures'''
+	end = int(np.searchsorted(store["sig"], no_sigs))
+	sliced = {name: store[name][:end] for name in COLUMNS}
+	if "s1" in store:
+		sliced["s1"] = store["s1"]
+	return sliced
+
+def signatures_to_columns(data):
+	'''
+	converts a list of signatures as written by gen_filter or gen_filter_sparse into columns for save_equations.
+	Rows of gen_filter have no coefficient index, they are stored by rows_to_challenges with coeff = 0.
+	'''
+	c, coeff, poly, sig, z, y = [], [], [], [], [], []
+	for i, s in enumerate(data):
+		if isinstance(s, tuple):
+			positions, signs, eq = s
+			c_i = encode_challenge(positions, signs)
+			rows = [(np.tile(c_i, (len(idx), 1)), idx, z_l, y_l) for idx, z_l, y_l in eq]
+		else:
+			rows = [(rows_to_challenges(C_l), np.zeros(len(z_l), dtype = np.uint8), z_l, y_l) for C_l, z_l, y_l in s]
+		for l, (c_l, idx, z_l, y_l) in enumerate(rows):
+			if len(z_l) == 0: continue
+			c.append(c_l)
+			coeff.append(idx)
+			poly.append(np.full(len(z_l), l, dtype = np.uint8))
+			sig.append(np.full(len(z_l), i, dtype = np.int32))
+			z.append(z_l)
+			y.append(y_l)
+	if not c:
+		# no signature has equations
+		return np.empty((0, 0), dtype = np.int16), np.empty(0, dtype = np.uint8), np.empty(0, dtype = np.uint8), np.empty(0, dtype = np.int32), np.empty(0, dtype = np.int32), np.empty(0, dtype = np.int32)
+	return np.vstack(c), np.concatenate(coeff), np.concatenate(poly), np.concatenate(sig), np.concatenate(z), np.concatenate(y)
@@ -0,0 +1,92 @@
+'''Weighted normal equations for sparse data matrices C with entries in {-1, 0, 1}
+
+Every row of C has only tau non-zero entries. Hence, C^T diag(w) C and C^T diag(w) z can be accumulated
+by scattering the tau^2 products of each row, which costs O(m * tau^2) instead of O(m * n^2).
+If numba is installed, the rows are split into blocks that are processed in parallel with one accumulator per block.
+Otherwise, scipy.sparse is used, which has the same complexity but runs single threaded.
+'''
+import importlib.util
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+# numba is only imported (and the kernel compiled) on first use
+NUMBA_FLAG = importlib.util.find_spec("numba") is not None
+_gram_kernel = None
+
+
+def _get_gram_kernel():
+	global _gram_kernel
+	if _gram_kernel is not None:
+		return _gram_kernel
+	from numba import njit, prange
+
+	@njit(parallel = True, cache = True)
+	def kernel(indptr, indices, data, w, z, n, n_blocks):
+		m = len(indptr) - 1
+		G = np.zeros((n_blocks, n, n))
+		b = np.zeros((n_blocks, n))
+		mu = np.zeros((n_blocks, n))
+		rows_per_block = (m + n_blocks - 1) // n_blocks
+		for k in prange(n_blocks):
+			for i in range(k * rows_per_block, min((k + 1) * rows_per_block, m)):
+				for p in range(indptr[i], indptr[i + 1]):
+					j = indices[p]
+					wc = w[i] * data[p]
+					mu[k, j] += wc
+					b[k, j] += wc * z[i]
+					for q in range(indptr[i], indptr[i + 1]):
+						G[k, j, indices[q]] += wc * data[q]
+		return G, b, mu
+
+	_gram_kernel = kernel
+	return _gram_kernel
+
+def weighted_normal_equations(C, w, z, n_blocks = None):
+	'''
+	computes the pieces of the weighted least squares problem for sparse C
+	C: scipy.sparse matrix of shape (m, n)
+	w: weights of shape (m,)
+	z: dependent variable of shape (m,)
+	n_blocks: number of row blocks that are processed in parallel, defaults to the number of numba threads
+
+	returns
+	G: C^T diag(w) C
+	b: C^T diag(w) z
+	mu: C^T w
+	'''
+	C = csr_matrix(C)
+	w = np.asarray(w, dtype = np.float64)
+	z = np.asarray(z, dtype = np.float64)
+	if NUMBA_FLAG:
+		import numba
+		if n_blocks is None:
+			n_blocks = numba.get_num_threads()
+		n_blocks = max(1, min(n_blocks, C.shape[0]))
+		G, b, mu = _get_gram_kernel()(C.indptr, C.indices, C.data.astype(np.float64), w, z, C.shape[1], n_blocks)
+		return G.sum(axis = 0), b.sum(axis = 0), mu.sum(axis = 0)
+	G = (C.T @ C.multiply(w.reshape(-1, 1)).tocsr()).toarray()
+	return G, C.T @ (w * z), C.T @ w
+
+def solve_normal_equations(G, b, mu, sum_w, sum_wz, fit_intercept = True):
+	'''
+	solves the weighted least squares problem given by weighted_normal_equations.
+	With fit_intercept, the intercept is eliminated by centering with the weighted means as sklearn's LinearRegression does.
+
+	returns
+	coef: estimated regressor
+	intercept: estimated intercept (0 without fit_intercept)
+	'''
+	if fit_intercept:
+		G = G - np.outer(mu, mu) / sum_w
+		b = b - mu * sum_wz / sum_w
+	try:
+		coef = np.linalg.solve(G, b)
+	except np.linalg.LinAlgError:
+		coef = np.linalg.lstsq(G, b, rcond = None)[0]
+	intercept = (sum_wz - mu @ coef) / sum_w if fit_intercept else 0.
+	return coef, intercept
+
+def weighted_lstsq(C, z, w, fit_intercept = True, n_blocks = None):
+	'''drop-in for LinearRegression().fit(C, z, sample_weight = w) with sparse C, returns coef and intercept'''
+	G, b, mu = weighted_normal_equations(C, w, z, n_blocks = n_blocks)
+	return solve_normal_equations(G, b, mu, np.sum(w), np.dot(w, z), fit_intercept = fit_intercept)
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import numpy as np
-from scipy.stats import rv_discrete  
 
 
 class Parameters:
@@ -36,6 +35,7 @@ class Parameters:
         prob(i) = 1-prob(0)/(2*(self.gamma_1)-1)
         Can then sample with that samples using self.biased_distrib.rvs
         """
+        from scipy.stats import rv_discrete
         y_range_size = len(range(self.y_range.start, self.y_range.stop))
         values = np.array(list(range(self.y_range.start, self.y_range.stop)))
         prob_zero = zero_amplifier/y_range_size
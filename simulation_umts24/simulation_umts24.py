@@ -5,31 +5,57 @@ We recommend generting up to 2* 10^6 signatures to achieve good results.
 Recommended setting for solving is threshold = 900000, mininum-signatures = 400000, stepsize = 50000'''
 
 import argparse
+import os
+import time
 import numpy as np
 from parameters import Parameters
+from equations import encode_challenge, row_support, expand_sparse, save_equations, load_equations, is_store, slice_signatures, signatures_to_columns
 from scipy.linalg import toeplitz
 import pickle
 import concurrent.futures as concurr
 from itertools import product
-from sklearn.linear_model import LinearRegression
-
-
-parser = argparse.ArgumentParser("solving UMTS24 with robust regression")
-parser.add_argument("--experiment",type=str, choices=["generate","solve"], default="generate", help="generate samples or solve them")
-parser.add_argument("--single_threadded",action="store_true",help="runs this singlethreaded",default=False)
-parser.add_argument("--cores",type=int,default=4,help="how many cores to use if multiprocessing")
-parser.add_argument("--stepsize",type=int,default=1000)
-parser.add_argument("--filepath",type=str,default='umts24_data',help="filepath to where to save / load from")
-parser.add_argument("--filterthresh",type=int,default=39,help="sqrt(2tau) * filterthresh for filtering or 39")
-parser.add_argument("--repeat",type=int,default=1,help="how many times to repeat the experiment")
-parser.add_argument("--threshold",type=int,default=10000,help="how many signatures to generate / process")
-parser.add_argument("--verbose",action="store_true",help="prints more output",default=True)
-
-parser.add_argument("--minimum_signatures",type=int,default=400000,help="minimum number of signatures to process")
-parser.add_argument("--tpr",type=float,default=0.99,help="true positive rate for Classifier")
-parser.add_argument("--fpr",type=float,default=0.01,help="false positive rate for Classifier")
-parser.add_argument("--huberparam",type=float,default=0.125,help="huber parameter")
-args = parser.parse_args()
+from scipy.sparse import issparse
+from gram import weighted_lstsq, weighted_normal_equations, solve_normal_equations
+from metrics import METRICS
+
+
+HUBER_PARAM = 0.125
+COMPACT = False # C as int8 and float32 irls iterations with a final float64 step, see irls
+SKETCH_SIZE = 4096 # initial sample size of irls_sketch
+SKETCH_SAMPLING = "uniform" # sampling of irls_sketch
+
+def parse_args(argv=None):
+	'''command line arguments, only parsed if this file is run as a script, so that e.g. irls can be imported'''
+	parser = argparse.ArgumentParser("solving UMTS24 with robust regression")
+	parser.add_argument("--experiment",type=str, choices=["generate","solve","convert","sweep"], default="generate", help="generate samples, solve them, convert pickled samples to the compact format or solve them for a grid of classifier operating points (--tprs x --fprs)")
+	parser.add_argument("--single_threadded",action="store_true",help="runs this singlethreaded",default=False)
+	parser.add_argument("--cores",type=int,default=4,help="how many cores to use if multiprocessing")
+	parser.add_argument("--stepsize",type=int,default=1000)
+	parser.add_argument("--filepath",type=str,default='umts24_data',help="filepath to where to save / load from")
+	parser.add_argument("--filterthresh",type=int,default=39,help="sqrt(2tau) * filterthresh for filtering or 39")
+	parser.add_argument("--repeat",type=int,default=1,help="how many times to repeat the experiment")
+	parser.add_argument("--threshold",type=int,default=10000,help="how many signatures to generate / process")
+	parser.add_argument("--verbose",action="store_true",help="prints more output",default=True)
+	parser.add_argument("--sparse",action="store_true",help="only generate the equations that survive the filter",default=False)
+	parser.add_argument("--format",type=str,choices=["pickle","npy"],default="pickle",help="write samples as pickle or as compact equation store (see equations.py)")
+
+	parser.add_argument("--minimum_signatures",type=int,default=400000,help="minimum number of signatures to process")
+	parser.add_argument("--tpr",type=float,default=0.99,help="true positive rate for Classifier")
+	parser.add_argument("--fpr",type=float,default=0.01,help="false positive rate for Classifier")
+	parser.add_argument("--tprs",type=float,nargs="+",default=None,help="true positive rates of the sweep (default: --tpr)")
+	parser.add_argument("--fprs",type=float,nargs="+",default=None,help="false positive rates of the sweep (default: --fpr)")
+	parser.add_argument("--huberparam",type=float,default=0.125,help="huber parameter")
+	parser.add_argument("--out_of_core",action="store_true",help="streams equations from an equation store (see equations.py) instead of loading them",default=False)
+	parser.add_argument("--blocksize",type=int,default=100000,help="number of equations per block if out_of_core")
+	parser.add_argument("--compact",action="store_true",help="stores C as int8 and runs the irls iterations in float32 with a final float64 step",default=False)
+	parser.add_argument("--sketch",action="store_true",help="solves with irls_sketch (methods cauchy_sketch and huber_sketch) on a growing subsample of the equations",default=False)
+	parser.add_argument("--sample_size",type=int,default=4096,help="initial sample size if sketch")
+	parser.add_argument("--sampling",type=str,choices=["uniform","leverage"],default="uniform",help="sampling of the equations if sketch")
+	parser.add_argument("--resume",action="store_true",help="skips everything already in the results file and continues the irls iterations of an interrupted unit from its checkpoint",default=False)
+	parser.add_argument("--seed",type=int,default=None,help="seed of the classifier simulation of solve (default: random), stored next to the results file and reused by --resume")
+	parser.add_argument("--metrics_port",type=int,default=None,help="serves live metrics (Prometheus text) on this port, see metrics.py")
+	parser.add_argument("--metrics_file",type=str,default=None,help="writes live metrics as JSON to this file every few seconds")
+	return parser.parse_args(argv)
 
 
 ############# generate samples #############
@@ -45,6 +71,19 @@ def gen_c_np(params: Parameters):
 	c_np[non_zero_indices] = np.random.choice([-1, 1], params.tau)
 	return c_np
 
+def gen_c_sparse(params: Parameters):
+	'''draws the vector c, but only returns the positions of the tau non-zero entries and their signs'''
+	positions = np.random.choice(params.n, params.tau, replace=False).astype(np.int16)
+	signs = np.random.choice([-1, 1], params.tau).astype(np.int8)
+	return positions, signs
+
+def c_matrix_rows(positions, signs, idx, params: Parameters):
+	'''rebuilds the rows idx of calculate_c_matrix_np(c) from the sparse representation of c'''
+	cols, vals = row_support(encode_challenge(positions, signs).reshape(1, -1), idx, params.n)
+	rows = np.zeros((len(cols), params.n), dtype=params.dtype)
+	np.put_along_axis(rows, cols, vals.astype(params.dtype), axis=1)
+	return rows
+
 def calculate_c_matrix_np(c , params: Parameters):
 	"""
 	Adapted from: https://github.com/KatinkaBou/Probabilistic-Bounds-On-Singular-Values-Of-Rotation-Matrices/blob/c92bfa863fc640ca0c39b321dde1696edf84d467/negacyclic_probabilistic_bound.py#L20
@@ -74,6 +113,32 @@ def gen_filter(i,verbose=False):
 		eq.append(filtered)
 	return eq
 
+def gen_filter_sparse(i,verbose=False):
+	"""returns: (c_positions, c_signs, list((idx_0,z_0,y_0),(idx_1,z_1,y_1),...))
+
+	same distribution as gen_filter, but only the equations that survive the filter are generated.
+	The rows of C are rebuilt from (c, idx) with c_matrix_rows when needed."""
+
+	if verbose:
+		print(i)
+	return gen_sig_sparse(S1,PARAMS,FILTER_THRESH)
+
+def gen_sig_sparse(s1,params:Parameters,filter_thresh):
+	positions, signs = gen_c_sparse(params)
+	# after rejection, every coefficient of z is uniform in ]-(gamma_1-beta), gamma_1-beta[ independent of cs.
+	# Hence, we draw which coefficients pass the filter first and only compute cs and y for those.
+	bound = params.gamma_1 - params.beta - 1
+	thresh = min(int(np.floor(filter_thresh)), bound)
+	keep = (2*thresh + 1) / (2*bound + 1)
+	eq = list()
+	for l in range(params.l):
+		idx = np.sort(np.random.choice(params.n, np.random.binomial(params.n, keep), replace=False)).astype(np.uint8)
+		z = np.random.randint(-thresh, thresh + 1, len(idx), dtype=params.dtype)
+		cols, vals = row_support(encode_challenge(positions, signs).reshape(1, -1), idx, params.n)
+		cs = np.sum(vals * s1[l][cols], axis=1, dtype=params.dtype)
+		eq.append((idx, z, z - cs))
+	return positions, signs, eq
+
 def gen_sig(s1,params:Parameters):
 	C = calculate_c_matrix_np(gen_c_np(params),params)
 	rtn_y = list()  
@@ -108,16 +173,27 @@ def gen_sig2(s1,params:Parameters):
 
 ############## solve ##############
 
-def process_sigs(data_unbatched,filt,tpr,fpr):
+def unpack_sig(sig, params: Parameters):
+	'''returns list((C_0,z_0,y_0),(C_1,z_1,y_1),...) for signatures of gen_filter and gen_filter_sparse'''
+	if isinstance(sig, tuple):
+		positions, signs, eq = sig
+		return [(c_matrix_rows(positions, signs, idx, params), z, y) for idx, z, y in eq]
+	return sig
+
+def process_sigs(data_unbatched,filt,tpr,fpr,params: Parameters = None,rng=None):
+	if params is None:
+		params = Parameters.get_nist_security_level(2)
 	#output format looks like this. assume that l=4.
 	Cs = [[],[],[],[]]
 	zs = [[],[],[],[]]
 	ys = [[],[],[],[]]
-	
+
 	#for sig in itemgetter(*idx)(data_unbatched):
 	for sig in data_unbatched:
+		sig = unpack_sig(sig, params)
 		for l in range(4):
-			Cs[l].append(sig[l][0])
+			# cast every block before stacking, so no int32 copy of all equations is made
+			Cs[l].append(sig[l][0].astype(np.int8) if COMPACT else sig[l][0])
 			zs[l].append(sig[l][1])
 			ys[l].append(sig[l][2])
 
@@ -133,21 +209,99 @@ def process_sigs(data_unbatched,filt,tpr,fpr):
 	zsSel = [[],[],[],[]]
 	ysSel = [[],[],[],[]]
 
-	#see UMTS24 algorithm 5
 	for l in range(4):
-		mask = np.zeros_like(ys[l],dtype=bool)
-		for i in range(len(ys[l])):
-			if ys[l][i] == 0:
-				if np.random.random()<tpr:
-					mask[i]=1
-			else:
-				if np.abs(ys[l][i])< filt and np.random.random()<fpr:
-					mask[i]=1
+		mask = classify(ys[l],filt,tpr,fpr,rng=rng)
 		CsSel[l]= Cs[l][mask]
 		zsSel[l]= zs[l][mask]
 		ysSel[l]= ys[l][mask]
 	return CsSel,zsSel,ysSel
 
+def classify(y,filt,tpr,fpr,u=None,rng=None):
+	'''simulates the classifier, see UMTS24 algorithm 5. Returns the mask of equations classified as y == 0.
+	u: uniform random numbers, one per equation. If not given, they are drawn from rng (default np.random) in the order of the per-equation loop
+	   of the original implementation (one draw for y == 0 or |y| < filt only), so seeded runs select the same equations as before.'''
+	if u is None:
+		drawn = (y == 0) | (np.abs(y) < filt)
+		u = np.ones(len(y))
+		u[drawn] = (np.random if rng is None else rng).random(np.count_nonzero(drawn))
+	return np.where(y == 0, u < tpr, (np.abs(y) < filt) & (u < fpr))
+
+def process_store(store,filt,tpr,fpr,params: Parameters,rng=None):
+	'''same as process_sigs for an equation store (see equations.py).
+	Only the selected rows of C are expanded, as sparse matrices so that irls uses the sparse Gram kernel.'''
+	CsSel, zsSel, ysSel = [], [], []
+	poly = np.asarray(store["poly"])
+	y = np.asarray(store["y"])
+	for l in range(params.l):
+		mask = poly == l
+		mask[mask] = classify(y[mask],filt,tpr,fpr,rng=rng)
+		CsSel.append(expand_sparse(store["c"][mask],store["coeff"][mask],params.n))
+		zsSel.append(np.asarray(store["z"][mask]))
+		ysSel.append(y[mask])
+	return CsSel,zsSel,ysSel
+
+def stream_equations(store,l,no_sigs,filt,tpr,fpr,params: Parameters,block_size=100000,seed=0):
+	'''
+	streams the selected equations of polynomial l of the first no_sigs signatures of an equation store (see equations.py).
+	Reads block_size equations at a time, so memory is bounded by block_size * tau.
+	The classifier is simulated with a generator seeded per block, hence every pass yields the same equations.
+
+	yields (C, z, y) with C as sparse matrix
+	'''
+	end = int(np.searchsorted(store["sig"], no_sigs))
+	for k, start in enumerate(range(0, end, block_size)):
+		block = slice(start, min(start + block_size, end))
+		y = np.asarray(store["y"][block])
+		u = np.random.default_rng((seed, k)).random(len(y))
+		mask = (np.asarray(store["poly"][block]) == l) & classify(y,filt,tpr,fpr,u=u)
+		C = expand_sparse(np.asarray(store["c"][block])[mask],np.asarray(store["coeff"][block])[mask],params.n)
+		yield C, np.asarray(store["z"][block])[mask], y[mask]
+
+def unpack_equations(data,params: Parameters):
+	'''all equations of a list of signatures (see process_sigs) or an equation store (see process_store) per polynomial, before classification.
+
+	returns Cs, zs, ys and sigs (index of the signature of every equation, ascending) per polynomial'''
+	Cs, zs, ys, sigs = [], [], [], []
+	if isinstance(data, dict):
+		poly = np.asarray(data["poly"])
+		for l in range(params.l):
+			mask = poly == l
+			Cs.append(expand_sparse(data["c"][mask],data["coeff"][mask],params.n))
+			zs.append(np.asarray(data["z"][mask]))
+			ys.append(np.asarray(data["y"][mask]))
+			sigs.append(np.asarray(data["sig"][mask]))
+		return Cs, zs, ys, sigs
+	for l in range(params.l):
+		Cs.append([]); zs.append([]); ys.append([]); sigs.append([])
+	for i, sig in enumerate(data):
+		sig = unpack_sig(sig, params)
+		for l in range(params.l):
+			Cs[l].append(sig[l][0].astype(np.int8) if COMPACT else sig[l][0])
+			zs[l].append(sig[l][1])
+			ys[l].append(sig[l][2])
+			sigs[l].append(np.full(len(sig[l][1]), i))
+	for l in range(params.l):
+		Cs[l] = np.vstack(Cs[l])
+		zs[l] = np.concatenate(zs[l])
+		ys[l] = np.concatenate(ys[l])
+		sigs[l] = np.concatenate(sigs[l])
+	return Cs, zs, ys, sigs
+
+def operating_point_bins(y,u,filt,tprs,fprs):
+	'''
+	bins of the equations for a grid of classifier operating points with common random numbers u (see classify).
+	An equation with y == 0 is selected for all tpr > u, one with 0 < |y| < filt for all fpr > u. Hence, the selected sets
+	of all operating points nest and every selected set is a union of bins:
+	bin j < len(tprs) holds the equations with y == 0 selected for the tprs[j:] (tprs sorted),
+	bin len(tprs) + 1 + j the equations with y != 0 selected for the fprs[j:] (fprs sorted),
+	bin len(tprs) and the last bin the equations that are never selected.
+
+	returns the bin of every equation
+	'''
+	zero = np.searchsorted(tprs, u, side="right")
+	small = len(tprs) + 1 + np.searchsorted(fprs, u, side="right")
+	return np.where(y == 0, zero, np.where(np.abs(y) < filt, small, len(tprs) + len(fprs) + 1))
+
 def log_to_file(file_path, log_string):
 	"""
 	Logs a string to a file. If the file doesn't exist, it will be created.
@@ -158,14 +312,85 @@ def log_to_file(file_path, log_string):
 	with open(file_path+".csv", 'a') as file:  # Open the file in append mode
 		file.write(log_string + '\n')  # Add a newline for each log entry
 
+def read_log(file_path):
+	"""
+	Reads the results written by run_attack and returns the set of finished (repeat,l,no_sigs,method).
+	An incomplete last line (e.g. after a crash) is removed from the file.
+
+	:param file_path: Path to the log file.
+	"""
+	done = set()
+	if not os.path.isfile(file_path+".csv"):
+		return done
+	with open(file_path+".csv", 'r+') as file:
+		lines = file.readlines()
+		if lines and not lines[-1].endswith('\n'):
+			lines = lines[:-1]
+			file.seek(0)
+			file.writelines(lines)
+			file.truncate()
+	for line in lines[1:]:
+		try:
+			repeat,l,no_sigs,_,_,method,_ = line.strip().split(",")
+			done.add((int(repeat),int(l),int(no_sigs),method))
+		except ValueError:
+			# blank or malformed line, the unit is solved again
+			continue
+	return done
+
+def save_estimates(file_path, estimates):
+	'''checkpoints irls estimates next to the log file, see unit_checkpoint. Replaces the file atomically.'''
+	with open(file_path+"_estimates.pkl.tmp","wb") as f:
+		pickle.dump(estimates,f)
+	os.replace(file_path+"_estimates.pkl.tmp",file_path+"_estimates.pkl")
+
+def load_estimates(file_path):
+	'''loads the estimates of save_estimates, or an empty dictionary'''
+	if not os.path.isfile(file_path+"_estimates.pkl"):
+		return dict()
+	with open(file_path+"_estimates.pkl","rb") as f:
+		return pickle.load(f)
+
+def unit_checkpoint(file_path, unit, t_init=0):
+	'''
+	returns a checkpoint function for irls that saves the estimate of the running unit (repeat,l,no_sigs,method) after every iteration.
+	The file only holds this unit: {unit: (s_hat, finished iterations)}. After a crash, irls of the same unit continues from it
+	(s_init and the remaining iterations) with exactly the iterations of an uninterrupted run. Other units never use it.
+	t_init: iterations finished before a resumed irls call, added to its count so that the file always holds the iterations of the whole unit
+	'''
+	return lambda s_hat, t: save_estimates(file_path, {unit: (s_hat, t + t_init)})
+
+def load_seed(file_path, seed=None):
+	'''
+	seed of the classifier simulation of a solve experiment, stored next to the log file. The equations of every (repeat,no_sigs) are selected
+	with a generator seeded by (seed,repeat,no_sigs), so a resumed run solves the same equations as the interrupted one.
+	A stored seed is kept, otherwise seed (or a random one if None) is stored.
+	'''
+	if os.path.isfile(file_path+"_seed.txt"):
+		with open(file_path+"_seed.txt") as f:
+			return int(f.read())
+	if seed is None:
+		seed = np.random.randint(1<<31)
+	with open(file_path+"_seed.txt","w") as f:
+		f.write(str(seed))
+	return seed
 
 def no_errors(s,shat):
 	'''number of error in estimate'''
 	return np.count_nonzero((np.round(shat) -s)!=0)
 
+def record_solve(stage,meth,seconds,errors):
+	'''updates the metrics of one solved (polynomial, method), see metrics.py'''
+	METRICS.inc("solves",stage=stage,method=meth,solved=int(errors==0))
+	METRICS.observe("solve_seconds",seconds,stage=stage,method=meth)
+
 def load_sigs(i,filepath):
-	'''loads signatures and keys to it. Please provide just the stem.'''
+	'''loads signatures and keys to it. Please provide just the stem.
+	Equation stores (see equations.py) are memory mapped instead of loaded.'''
 	filepath = filepath+str(i)
+	if is_store(filepath):
+		store = load_equations(filepath)
+		return store, store["s1"]
 	with open(filepath+"_key.pkl","rb") as f:
 		key = pickle.load(f)
 
@@ -175,16 +400,28 @@ def load_sigs(i,filepath):
 	data_unbatched = data
 	return data_unbatched , key
 
-def run_attack(PARAMS,CsSel,zsSel,ysSel,S1,methods,repeat,nosigs,filepath,verbose=True):
+def run_attack(PARAMS,CsSel,zsSel,ysSel,S1,methods,repeat,nosigs,filepath,verbose=True,done=frozenset(),estimates=None):
+	'''runs all methods for all polynomials and logs the results.
+	done: set of (repeat,l,nosigs,method) to skip, see read_log
+	estimates: checkpoint of an interrupted unit, see load_estimates and unit_checkpoint. The irls iterations of every unit are checkpointed.'''
+	estimates = estimates or dict()
 	for l in range(PARAMS.l):
 		for meth in methods:
+			unit = (repeat,l,nosigs,meth)
+			if unit in done: continue
 			if verbose:
 				print(meth)
+			s_init, t_init = estimates.get(unit, (None, 0))
+			checkpoint = unit_checkpoint(filepath, unit, t_init)
+			start = time.time()
 			if meth == "cauchy":
-				shat,_ = irls(C=CsSel[l],z=zsSel[l],s=S1[l],loss="cauchy",iterations=30)
+				shat,_ = irls(C=CsSel[l],z=zsSel[l],s=S1[l],loss="cauchy",iterations=30-t_init,s_init=s_init,dtype=irls_dtype(),checkpoint=checkpoint)
 			if meth == "huber":
 				#solved with irls to to have less package dependencies
-				shat,_ = irls(C=CsSel[l],z=zsSel[l],s=S1[l],loss="huber",iterations=30,huberparam = HUBER_PARAM)
+				shat,_ = irls(C=CsSel[l],z=zsSel[l],s=S1[l],loss="huber",iterations=30-t_init,huberparam = HUBER_PARAM,s_init=s_init,dtype=irls_dtype(),checkpoint=checkpoint)
+			if meth.endswith("_sketch"):
+				# the samples of irls_sketch start over from s_init, so it is not checkpointed
+				shat,_ = irls_sketch(C=CsSel[l],z=zsSel[l],loss=meth[:-len("_sketch")],iterations=30,huberparam = HUBER_PARAM,sample_size=SKETCH_SIZE,sampling=SKETCH_SAMPLING)
 
 			#logging results
 			if verbose:
@@ -193,58 +430,334 @@ def run_attack(PARAMS,CsSel,zsSel,ysSel,S1,methods,repeat,nosigs,filepath,verbos
 			true_eq = np.count_nonzero(ysSel[l]==0)
 			contamination = (num_eq-true_eq)/num_eq 
 			logstring = ",".join(map(str,[repeat,l,nosigs,num_eq,contamination,meth,no_errors(S1[l],shat)]))
+			record_solve("solve",meth,time.time()-start,no_errors(S1[l],shat))
 			
 			log_to_file(filepath,logstring)
+			save_estimates(filepath,dict())
+
+def run_attack_out_of_core(PARAMS,store,filt,tpr,fpr,S1,methods,repeat,nosigs,filepath,block_size=100000,verbose=True,done=frozenset(),estimates=None,seed=0):
+	'''same as run_attack, but streams the equations from the store for every irls iteration.
+	seed: of the classifier simulation, see stream_equations'''
+	estimates = estimates or dict()
+	for l in range(PARAMS.l):
+		if all((repeat,l,nosigs,meth) in done for meth in methods): continue
+		blocks = lambda: stream_equations(store,l,nosigs,filt,tpr,fpr,PARAMS,block_size=block_size,seed=seed)
+		num_eq, true_eq = 0, 0
+		for C, z, y in blocks():
+			#sanity check
+			assert np.all(z == y + C@S1[l]), "something went wrong unpacking the signatures"
+			num_eq += len(y)
+			true_eq += np.count_nonzero(y==0)
+		for meth in methods:
+			unit = (repeat,l,nosigs,meth)
+			if unit in done: continue
+			if verbose:
+				print(meth)
+			s_init, t_init = estimates.get(unit, (None, 0))
+			checkpoint = unit_checkpoint(filepath, unit, t_init)
+			start = time.time()
+			if meth == "cauchy":
+				shat,_ = irls_streaming(blocks,PARAMS.n,s=S1[l],loss="cauchy",iterations=30-t_init,s_init=s_init,checkpoint=checkpoint)
+			if meth == "huber":
+				shat,_ = irls_streaming(blocks,PARAMS.n,s=S1[l],loss="huber",iterations=30-t_init,huberparam = HUBER_PARAM,s_init=s_init,checkpoint=checkpoint)
+
+			#logging results
+			if verbose:
+				print("log "+meth)
+			contamination = (num_eq-true_eq)/num_eq
+			logstring = ",".join(map(str,[repeat,l,nosigs,num_eq,contamination,meth,no_errors(S1[l],shat)]))
+			record_solve("solve",meth,time.time()-start,no_errors(S1[l],shat))
+
+			log_to_file(filepath,logstring)
+			save_estimates(filepath,dict())
+
+def run_sweep(PARAMS,Cs,zs,ys,sigs,S1,methods,tprs,fprs,repeat,steps,filt,filepath,verbose=True):
+	'''
+	runs all methods for a grid of classifier operating points (tprs x fprs) and all numbers of signatures in steps on one loaded set of signatures.
+	Cs, zs, ys, sigs: all equations per polynomial, see unpack_equations
+
+	The classifier uses the same random number per equation for all operating points and numbers of signatures, so the selected equations nest.
+	The unweighted normal equations of every bin of operating_point_bins are accumulated once per step over the new signatures only.
+	The first irls iteration (ordinary least squares) of every operating point is solved from the sums of its bins,
+	the remaining iterations run on the selected equations, warm started from it.
+	'''
+	tpr_edges, fpr_edges = np.array(sorted(set(tprs))), np.array(sorted(set(fprs)))
+	n_bins = len(tpr_edges) + len(fpr_edges) + 2
+	total, finished = PARAMS.l * len(steps) * len(tprs) * len(fprs) * len(methods), 0
+	for l in range(PARAMS.l):
+		u = np.random.random(len(ys[l]))
+		bins = operating_point_bins(ys[l],u,filt,tpr_edges,fpr_edges)
+		G, b, mu = np.zeros((n_bins, PARAMS.n, PARAMS.n)), np.zeros((n_bins, PARAMS.n)), np.zeros((n_bins, PARAMS.n))
+		count, sum_z, true_eq = np.zeros(n_bins), np.zeros(n_bins), np.zeros(n_bins)
+		start = 0
+		for no_sigs in steps:
+			end = int(np.searchsorted(sigs[l], no_sigs))
+			for k in range(n_bins):
+				idx = start + np.flatnonzero(bins[start:end] == k)
+				if len(idx) == 0: continue
+				G_k, b_k, mu_k = weighted_normal_equations(Cs[l][idx], np.ones(len(idx)), zs[l][idx])
+				G[k] += G_k
+				b[k] += b_k
+				mu[k] += mu_k
+				count[k] += len(idx)
+				sum_z[k] += np.sum(zs[l][idx])
+				true_eq[k] += np.count_nonzero(ys[l][idx] == 0)
+			start = end
+			for tpr, fpr in product(tprs, fprs):
+				# bins of the operating point
+				selected = list(range(np.searchsorted(tpr_edges, tpr) + 1)) + [len(tpr_edges) + 1 + j for j in range(np.searchsorted(fpr_edges, fpr) + 1)]
+				s_ols, _ = solve_normal_equations(G[selected].sum(axis=0), b[selected].sum(axis=0), mu[selected].sum(axis=0), count[selected].sum(), sum_z[selected].sum())
+				mask = classify(ys[l][:end],filt,tpr,fpr,u=u[:end])
+				assert np.count_nonzero(mask) == count[selected].sum(), "bins do not match the classifier"
+				C, z = Cs[l][:end][mask], zs[l][:end][mask]
+				num_eq = len(z)
+				contamination = (num_eq-true_eq[selected].sum())/num_eq
+				for meth in methods:
+					if verbose:
+						print(repeat,l,no_sigs,tpr,fpr,meth)
+					start_solve = time.time()
+					if np.all(np.round(s_ols) == S1[l]):
+						# irls stops after the first iteration
+						shat = s_ols
+					else:
+						shat,_ = irls(C=C,z=z,s=S1[l],loss=meth,iterations=29,huberparam = HUBER_PARAM,s_init=s_ols,dtype=irls_dtype())
+					logstring = ",".join(map(str,[repeat,l,no_sigs,tpr,fpr,num_eq,contamination,meth,no_errors(S1[l],shat)]))
+					log_to_file(filepath,logstring)
+					record_solve("sweep",meth,time.time()-start_solve,no_errors(S1[l],shat))
+					finished += 1
+					METRICS.progress("sweep",finished,total,repeat=repeat)
 
 def huber_weight(r, delta=1):
 	'''the huber weight function with flooring'''
 	return np.where(np.abs(r) <= delta, 1, delta /(0.0000001 + np.abs(r)))
 
-def irls(C,z,s,loss = "cauchy",iterations=100,huberparam = 0.125):
+def irls_weights(residuals,loss = "cauchy",huberparam = 0.125):
+	'''weights of the next irls iteration, not normalized'''
+	if loss == "cauchy":
+		return 1 / (1 + residuals**2)
+	elif loss == "huber":
+		return huber_weight(residuals,delta=huberparam)
+	else:
+		raise NotImplementedError("the loss function you chose is not implemented.")
+
+def irls_dtype():
+	'''dtype of the irls iterations, float32 if COMPACT'''
+	return np.float32 if COMPACT else np.float64
+
+def irls(C,z,s,loss = "cauchy",iterations=100,huberparam = 0.125,s_init=None,dtype=np.float64,checkpoint=None,block_size=100000):
 	'''
 	solves an iterative reweighted least squares regression with the following parameters.
 	estimates a key and rounds it to the nearest integer. Then compares if actually matches and stops if so.
 
-	C: Data matrix
+	C: Data matrix, if it is a scipy.sparse matrix the weighted least squares are solved with the sparse Gram kernel of gram.py
 	z: dependent variable
 	s: true value for estimator
 	loss: loss function to choose, supports "cauchy" (cauchy loss function) and "huber" (huber loss function)
 	iterations: stops after those iterations if it did not converge to the correct solution
 	huberparam: if huber loss is used, this is the parameter for the loss function ("delta")
+	s_init: warm start, the first weights are computed from the residuals of this estimate instead of being uniform
+	checkpoint: if given, called as checkpoint(s_hat, t) with the estimate after t < iterations finished iterations. irls with s_init = s_hat
+	            and iterations - t iterations continues exactly like the interrupted run (see unit_checkpoint)
+	dtype: of the iterations for dense C. With np.float32, C (e.g. stored as int8) and z are converted once and the final estimate
+	       is recomputed in float64 with the weights of the last iteration. A warning is printed if its rounding differs from the float32 estimate.
+	block_size: rows per block of the final float64 step, which accumulates the normal equations (see gram.py) instead of converting all of C
 
 	returns
 	s_hat: estimated regressor (estimated key for dilithium)
 	t: how many iterations have past?
 	'''
+	from sklearn.linear_model import LinearRegression
 	m,n = C.shape
 	lr = LinearRegression(n_jobs=1)
-	weights = np.ones(m) / m
+	C_input, z_input = C, z
+	if not issparse(C):
+		C = C.astype(dtype, copy=False)
+		z = np.asarray(z).astype(dtype, copy=False)
+	if s_init is None:
+		weights = np.ones(m) / m
+	else:
+		weights = irls_weights(z - C @ s_init,loss=loss,huberparam=huberparam)
+		weights /= np.sum(weights)
 
 	for t in range(iterations):
 		# Fit Least Squares (weighted)
-		lr.fit(C, z, sample_weight = weights)
-		s_hat = lr.coef_
+		fit_weights = weights
+		if issparse(C):
+			s_hat, _ = weighted_lstsq(C, z, weights)
+		else:
+			lr.fit(C, z, sample_weight = weights)
+			s_hat = lr.coef_
 		# Calculate the number of correct predictions (round beta_est to integer)
 		correct_predictions = np.sum(s == np.round(s_hat))
 		# Calculate the residuals
 		residuals = z - C @ s_hat
-		if loss == "cauchy":
-			weights = 1 / (1 + residuals**2)
-			weights /= np.sum(weights)
-		elif loss == "huber":
-			weights = huber_weight(residuals,delta=huberparam)
-			weights /= np.sum(weights)
-		else:
-			raise NotImplementedError("the loss function you chose is not implemented.")
+		weights = irls_weights(residuals,loss=loss,huberparam=huberparam)
+		weights /= np.sum(weights)
+
+		if correct_predictions >= n: break
+		if checkpoint is not None and t + 1 < iterations:
+			checkpoint(s_hat, t + 1)
+	METRICS.inc("irls_iterations",t+1,loss=loss)
+	if not issparse(C) and np.dtype(dtype) != np.float64:
+		# repeat the last fit in float64, block by block so that no float64 copy of C is made
+		s_low = s_hat
+		z_input = np.asarray(z_input, dtype=np.float64)
+		fit_weights = fit_weights.astype(np.float64)
+		G, b, mu = np.zeros((n, n)), np.zeros(n), np.zeros(n)
+		for start in range(0, m, block_size):
+			block = slice(start, start + block_size)
+			G_k, b_k, mu_k = weighted_normal_equations(C_input[block], fit_weights[block], z_input[block])
+			G += G_k
+			b += b_k
+			mu += mu_k
+		s_hat, _ = solve_normal_equations(G, b, mu, np.sum(fit_weights), np.dot(fit_weights, z_input))
+		mismatch = np.count_nonzero(np.round(s_low) != np.round(s_hat))
+		if mismatch:
+			print(f"warning: {np.dtype(dtype).name} irls estimate differs from float64 in {mismatch} rounded coefficients")
+	return s_hat,t
 
+def irls_streaming(blocks,n,s,loss = "cauchy",iterations=100,huberparam = 0.125,s_init=None,checkpoint=None):
+	'''
+	irls for equation sets that do not fit into memory, see irls for the parameters.
+	blocks: function that returns a new iterator over blocks (C, z, ...) on every call, e.g. stream_equations
+	n: number of columns of C
+
+	Every iteration is a single pass over the blocks: residuals and weights of the previous estimate are computed per block
+	and the weighted normal equations (see gram.py) are accumulated right away. Memory is bounded by the block size and n^2.
+	The weights are not normalized, since scaling them does not change the weighted least squares estimate.
+	'''
+	s_hat = s_init
+	for t in range(iterations):
+		G, b, mu = np.zeros((n, n)), np.zeros(n), np.zeros(n)
+		sum_w, sum_wz = 0., 0.
+		for C, z, *_ in blocks():
+			if s_hat is None:
+				weights = np.ones(len(z))
+			else:
+				weights = irls_weights(z - C @ s_hat,loss=loss,huberparam=huberparam)
+			G_k, b_k, mu_k = weighted_normal_equations(C, weights, z)
+			G += G_k
+			b += b_k
+			mu += mu_k
+			sum_w += np.sum(weights)
+			sum_wz += np.dot(weights, z)
+		s_hat, _ = solve_normal_equations(G, b, mu, sum_w, sum_wz)
+		# Calculate the number of correct predictions (round beta_est to integer)
+		correct_predictions = np.sum(s == np.round(s_hat))
 		if correct_predictions >= n: break
+		if checkpoint is not None and t + 1 < iterations:
+			checkpoint(s_hat, t + 1)
+	METRICS.inc("irls_iterations",t+1,loss=loss)
 	return s_hat,t
 
+def leverage_scores(C,rng,pilot_size,block_size=100000):
+	'''
+	approximate leverage scores c_i (C^T C)^-1 c_i^T of all rows of C (dense or sparse).
+	C^T C is estimated from a uniform pilot sample of pilot_size rows, the scores are computed in blocks of block_size rows.
+	'''
+	m,n = C.shape
+	pilot = C[np.sort(rng.choice(m, min(pilot_size, m), replace=False))]
+	G = np.asarray((pilot.T @ pilot).todense() if issparse(pilot) else pilot.T @ pilot, dtype=np.float64) * (m / pilot.shape[0])
+	G_inv = np.linalg.pinv(G)
+	scores = np.empty(m)
+	for start in range(0, m, block_size):
+		block = C[start:start + block_size]
+		product = np.asarray(block @ G_inv)
+		scores[start:start + block_size] = np.asarray(block.multiply(product).sum(axis=1)).ravel() if issparse(block) else np.sum(product * block, axis=1)
+	return np.maximum(scores, 0)
+
+def verify_candidate(C,z,s_hat,block_size=100000,z_score=3):
+	'''
+	checks a rounded key candidate against all equations in one pass over blocks of block_size rows, without knowing the key.
+	Inliers (y == 0) are fulfilled exactly by the correct key, while the residuals of outliers are spread smoothly around 0.
+	Hence, for every coefficient j, the equations with j in their support have more residuals 0 than the average of the residuals -1 and 1.
+	For a wrong coefficient j, this spike at 0 vanishes (the inliers with j in their support have residual +-(s_j - s_hat_j)).
+	The candidate is accepted if the spike exceeds z_score standard deviations for every coefficient.
+
+	returns
+	accepted: bool
+	exact: indices of the exactly fulfilled equations
+	'''
+	m,n = C.shape
+	s_round = np.round(s_hat)
+	exact_j, near_j, exact = np.zeros(n), np.zeros(n), []
+	for start in range(0, m, block_size):
+		block = C[start:start + block_size]
+		residuals = np.asarray(z[start:start + block_size]) - block @ s_round
+		support = abs(block)
+		exact_j += np.asarray(support[residuals == 0].sum(axis=0)).ravel()
+		near_j += np.asarray(support[np.abs(residuals) == 1].sum(axis=0)).ravel()
+		exact.append(start + np.flatnonzero(residuals == 0))
+	spike = exact_j - near_j / 2
+	noise = np.sqrt(exact_j + near_j / 4 + 1)
+	return bool(np.min(spike / noise) >= z_score), np.concatenate(exact)
+
+def irls_sketch(C,z,loss = "cauchy",iterations=30,huberparam = 0.125,sample_size=4096,growth=2,sampling="uniform",block_size=100000,seed=0,s_init=None,convergence_eps=0.01,stable=3):
+	'''
+	irls on a growing subsample of the equations, for very large equation sets. See irls for the parameters.
+
+	The rows are ordered once at random ("uniform") or with probabilities proportional to their approximate leverage scores ("leverage"),
+	the samples are prefixes of this order and therefore nested. irls runs on the first sample_size rows until the estimate changes by less than convergence_eps (max norm)
+	or its rounding did not change for stable iterations (on a sample only, an early rounded estimate is mostly rejected and costs a whole round), then the candidate is checked against all equations in one streaming pass (verify_candidate). If it is rejected, the sample grows by the factor growth
+	and irls starts over on it (from s_init, a rejected candidate is a bad warm start for the non-convex losses). The grown sample also contains up to the same number of equations that the rejected candidate fulfills exactly,
+	these are mostly inliers (all inliers without a wrong coefficient in their support), which raises the share of inliers in the sample.
+	Inliers are fulfilled exactly, so the rows need no reweighting by their sampling probabilities.
+	Every irls iteration costs O(sample size), only the check touches all equations.
+
+	returns
+	s_hat: estimated regressor (estimated key for dilithium)
+	t: how many irls iterations have past (over all samples)
+	'''
+	from sklearn.linear_model import LinearRegression
+	m,n = C.shape
+	rng = np.random.default_rng(seed)
+	if sampling == "leverage":
+		# Efraimidis-Spirakis keys: ordering by them samples without replacement proportional to the scores
+		scores = leverage_scores(C,rng,min(sample_size, m),block_size=block_size)
+		order = np.argsort(-np.log(rng.random(m)) / np.maximum(scores, 1e-12))
+	elif sampling == "uniform":
+		order = rng.permutation(m)
+	else:
+		raise NotImplementedError("the sampling you chose is not implemented.")
+	lr = LinearRegression(n_jobs=1)
+	t_total, size, exact = 0, min(sample_size, m), np.array([], dtype=int)
+	while True:
+		idx = np.union1d(order[:size], rng.permutation(exact)[:size])
+		C_s, z_s = C[idx], np.asarray(z)[idx]
+		if s_init is None:
+			weights = np.ones(len(idx)) / len(idx)
+		else:
+			weights = irls_weights(z_s - C_s @ s_init,loss=loss,huberparam=huberparam)
+			weights /= np.sum(weights)
+		last, unchanged = None, 0
+		for t in range(iterations):
+			if issparse(C_s):
+				s_hat, _ = weighted_lstsq(C_s, z_s, weights)
+			else:
+				lr.fit(C_s, z_s, sample_weight = weights)
+				s_hat = lr.coef_
+			weights = irls_weights(z_s - C_s @ s_hat,loss=loss,huberparam=huberparam)
+			weights /= np.sum(weights)
+			t_total += 1
+			METRICS.inc("irls_iterations",loss=loss)
+			unchanged = unchanged + 1 if last is not None and np.array_equal(np.round(s_hat), np.round(last)) else 0
+			# converged on this sample, or the rounded candidate did not change for stable iterations (it is checked anyway, except for the full set)
+			if last is not None and (np.max(np.abs(s_hat - last)) < convergence_eps or (size < m and unchanged >= stable)): break
+			last = s_hat
+		METRICS.set("sketch_size",len(idx),loss=loss)
+		accepted, exact = verify_candidate(C,z,s_hat,block_size=block_size)
+		METRICS.inc("sketch_checks",loss=loss,accepted=int(accepted))
+		if accepted or size == m:
+			return s_hat, t_total
+		size = min(int(size * growth), m)
+
 ######## main ########
 
 if __name__ == '__main__':
+	args = parse_args()
 	if args.verbose:
 		print(args)
+	METRICS.start(port=args.metrics_port,path=args.metrics_file)
 
 	if args.experiment == "generate":
 		PARAMS = Parameters.get_nist_security_level(2)
@@ -253,13 +766,23 @@ if __name__ == '__main__':
 	
 			S1 = keygen(params=PARAMS)
 			final_results = list()
-			step = range(args.threshold)
-			final_results = list(map(gen_filter,step))
-
+			for i in range(args.threshold):
+				final_results.append(gen_filter_sparse(i) if args.sparse else gen_filter(i))
+				METRICS.inc("signatures",stage="generate")
+				METRICS.progress("generate",i+1,args.threshold,repeat=rep)
+
+			if args.format == "npy":
+				save_equations(args.filepath+str(rep),*signatures_to_columns(final_results),s1=S1)
+				continue
 			with open(args.filepath+str(rep)+".pkl","wb") as f1:
 				pickle.dump(final_results,f1)
 			with open(args.filepath+str(rep)+"_key.pkl","wb") as f2:
 				pickle.dump(S1,f2)
+
+	if args.experiment == "convert":
+		for rep in range(args.repeat):
+			data_unbatched, s1 = load_sigs(rep,args.filepath)
+			save_equations(args.filepath+str(rep),*signatures_to_columns(data_unbatched),s1=s1)
 	
 	if args.experiment == "solve":
 		methods = ["cauchy","huber"]
@@ -267,15 +790,39 @@ if __name__ == '__main__':
 		# recommended parameters for rage are range(400000,900000,50000)
 
 		HUBER_PARAM = args.huberparam
+		COMPACT = args.compact
+		if args.sketch:
+			assert not args.out_of_core, "sketch needs the equations in memory"
+			methods = [meth+"_sketch" for meth in methods]
+			SKETCH_SIZE, SKETCH_SAMPLING = args.sample_size, args.sampling
 		filepathwrite = args.filepath+"results"+str(args.tpr)+"_"+str(args.fpr)
-		log_to_file(filepathwrite,"repeat,l,no_sigs,num_eq,contamination,method,num_errors")	
+		done, estimates = set(), dict()
+		if args.resume:
+			done = read_log(filepathwrite)
+			estimates = load_estimates(filepathwrite)
+		elif os.path.isfile(filepathwrite+"_seed.txt"):
+			os.remove(filepathwrite+"_seed.txt")
+		seed = load_seed(filepathwrite, args.seed)
+		if not (args.resume and os.path.isfile(filepathwrite+".csv")):
+			log_to_file(filepathwrite,"repeat,l,no_sigs,num_eq,contamination,method,num_errors")	
 		if args.verbose:
 			print("hello")
+		PARAMS = Parameters.get_nist_security_level(2)
+		steps = range(args.minimum_signatures,args.threshold+1,args.stepsize)
+		units = lambda rep, no_sigs: [(rep,l,no_sigs,meth) for l in range(PARAMS.l) for meth in methods]
+		total = [unit for rep in range(args.repeat) for no_sigs in steps for unit in units(rep,no_sigs)]
+		finished = sum(unit in done for unit in total)
+		METRICS.progress("solve",finished,len(total))
 		for rep in range(args.repeat):
+			if all(unit in done for no_sigs in steps for unit in units(rep,no_sigs)):
+				continue
 			##load sigs
 			data_unbatched, s1 = load_sigs(rep,args.filepath)
 			print("data loaded")
-			for no_sigs in range(args.minimum_signatures,args.threshold+1,args.stepsize):
+			assert not args.out_of_core or isinstance(data_unbatched,dict), "out_of_core needs an equation store"
+			for no_sigs in steps:
+				if all(unit in done for unit in units(rep,no_sigs)):
+					continue
 				if args.verbose:
 					print("rep",rep,"num sigs",no_sigs)
 
@@ -285,11 +832,48 @@ if __name__ == '__main__':
 				FILTER_THRESH = 2*np.sqrt(2*PARAMS.tau)
 
 				##unpack sigs to 4 parts
-				CsSel,zsSel,ysSel = process_sigs(data_unbatched[:no_sigs],FILTER_THRESH,fpr=args.fpr,tpr=args.tpr)
-				#sanity check
-				for l in range(PARAMS.l):
-					assert np.all(zsSel[l] == ysSel[l] + CsSel[l]@s1[l]), "something went wrong unpacking the signatures"
-				##recover real key
-				##attack
-				run_attack(PARAMS,CsSel,zsSel,ysSel,s1,methods,rep,no_sigs,filepathwrite,verbose=False)
-
+				METRICS.set("no_sigs",no_sigs,repeat=rep)
+				# the equations of (rep,no_sigs) only depend on the stored seed, see load_seed
+				rng = np.random.default_rng((seed,rep,no_sigs))
+				if args.out_of_core:
+					run_attack_out_of_core(PARAMS,data_unbatched,FILTER_THRESH,args.tpr,args.fpr,s1,methods,rep,no_sigs,filepathwrite,block_size=args.blocksize,verbose=False,done=done,estimates=estimates,seed=int(rng.integers(1<<31)))
+				else:
+					if isinstance(data_unbatched,dict):
+						CsSel,zsSel,ysSel = process_store(slice_signatures(data_unbatched,no_sigs),FILTER_THRESH,fpr=args.fpr,tpr=args.tpr,params=PARAMS,rng=rng)
+					else:
+						CsSel,zsSel,ysSel = process_sigs(data_unbatched[:no_sigs],FILTER_THRESH,fpr=args.fpr,tpr=args.tpr,params=PARAMS,rng=rng)
+					#sanity check
+					for l in range(PARAMS.l):
+						assert np.all(zsSel[l] == ysSel[l] + CsSel[l]@s1[l]), "something went wrong unpacking the signatures"
+					##recover real key
+					##attack
+					run_attack(PARAMS,CsSel,zsSel,ysSel,s1,methods,rep,no_sigs,filepathwrite,verbose=False,done=done,estimates=estimates)
+				finished += sum(unit not in done for unit in units(rep,no_sigs))
+				METRICS.progress("solve",finished,len(total))
+
+	if args.experiment == "sweep":
+		methods = ["cauchy","huber"]
+		assert args.minimum_signatures < args.threshold, "need to have at least as many signatures as threshold"
+		HUBER_PARAM = args.huberparam
+		COMPACT = args.compact
+		tprs = args.tprs or [args.tpr]
+		fprs = args.fprs or [args.fpr]
+		filepathwrite = args.filepath+"sweep"
+		if not os.path.isfile(filepathwrite+".csv"):
+			log_to_file(filepathwrite,"repeat,l,no_sigs,tpr,fpr,num_eq,contamination,method,num_errors")
+		PARAMS = Parameters.get_nist_security_level(2)
+		FILTER_THRESH = 2*np.sqrt(2*PARAMS.tau)
+		steps = range(args.minimum_signatures,args.threshold+1,args.stepsize)
+		for rep in range(args.repeat):
+			##load and unpack sigs once for all operating points
+			data_unbatched, s1 = load_sigs(rep,args.filepath)
+			if isinstance(data_unbatched,dict):
+				data_unbatched = slice_signatures(data_unbatched,steps[-1])
+			else:
+				data_unbatched = data_unbatched[:steps[-1]]
+			Cs,zs,ys,sigs = unpack_equations(data_unbatched,PARAMS)
+			print("data loaded")
+			#sanity check
+			for l in range(PARAMS.l):
+				assert np.all(zs[l] == ys[l] + Cs[l]@s1[l]), "something went wrong unpacking the signatures"
+			run_sweep(PARAMS,Cs,zs,ys,sigs,s1,methods,tprs,fprs,rep,steps,FILTER_THRESH,filepathwrite,verbose=args.verbose)